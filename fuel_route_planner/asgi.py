@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_planner.settings')
 
 application = get_asgi_application()
+
+# Only server processes load this module, so management commands never build the index.
+if settings.FUEL_INDEX_WARMUP:
+    from routes.services.fuel import start_index_warmup
+
+    start_index_warmup()
@@ -146,5 +146,40 @@ STATIC_URL = '/static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 ORS_API_KEY = env("ORS_API_KEY", default="")
+# Point at a local stand-in (see `manage.py loadtest`) to run without the real API
+ORS_BASE_URL = env("ORS_BASE_URL", default="https://api.openrouteservice.org").rstrip("/")
 GEOAPIFY_KEY = env("GEOAPIFY_KEY", default="")
 
+# App logs (index warmup, shard loads, plan workers) go to the console
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "routes": {"handlers": ["console"], "level": env("ROUTES_LOG_LEVEL", default="INFO")},
+    },
+}
+
+# Plans kept in memory per process for fast mid-trip replanning
+REPLAN_CACHE_SIZE = env.int("REPLAN_CACHE_SIZE", default=128)
+
+# Fuel station index: server processes (wsgi/asgi) build it in a background thread at startup.
+# Requests that need it before it is ready either wait for that build (up to
+# FUEL_INDEX_WAIT_SECONDS) or get a 503 straight away: FUEL_INDEX_COLD_POLICY = "wait" | "reject".
+FUEL_INDEX_WARMUP = env.bool("FUEL_INDEX_WARMUP", default=True)
+# Build the index before serving instead (gunicorn --preload: forked workers inherit it warm).
+FUEL_INDEX_PRELOAD = env.bool("FUEL_INDEX_PRELOAD", default=False)
+FUEL_INDEX_COLD_POLICY = env("FUEL_INDEX_COLD_POLICY", default="wait")
+FUEL_INDEX_WAIT_SECONDS = env.float("FUEL_INDEX_WAIT_SECONDS", default=30.0)
+
+# "monolithic": one tree over every station. "sharded": one tree per state, built the first time a
+# query comes near that state and evicted least recently used once the resident shards exceed
+# FUEL_INDEX_MEMORY_BUDGET_MB.
+FUEL_INDEX_MODE = env("FUEL_INDEX_MODE", default="monolithic")
+FUEL_INDEX_MEMORY_BUDGET_MB = env.float("FUEL_INDEX_MEMORY_BUDGET_MB", default=256.0)
+
+# Corridor search backend: "kdtree" (in-memory index per process) or "database"
+# (bounding-box queries on the latitude/longitude index; no index held in memory).
+FUEL_CORRIDOR_BACKEND = env("FUEL_CORRIDOR_BACKEND", default="kdtree")
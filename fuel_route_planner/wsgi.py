@@ -9,8 +9,19 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fuel_route_planner.settings')
 
 application = get_wsgi_application()
+
+# Only server processes load this module, so management commands never build the index.
+if settings.FUEL_INDEX_PRELOAD:
+    from routes.services.fuel import preload_index
+
+    preload_index()
+elif settings.FUEL_INDEX_WARMUP:
+    from routes.services.fuel import start_index_warmup
+
+    start_index_warmup()
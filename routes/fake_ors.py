@@ -0,0 +1,224 @@
+"""Local OpenRouteService stand-in (geocode + directions) for offline load tests."""
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import polyline
+
+EARTH_RADIUS_KM = 6371.0
+# road distance is longer than the straight line between waypoints
+ROAD_FACTOR = 1.2
+
+CITIES: Dict[str, Tuple[float, float]] = {
+    "New York, NY": (40.7128, -74.0060),
+    "Los Angeles, CA": (34.0522, -118.2437),
+    "Chicago, IL": (41.8781, -87.6298),
+    "Houston, TX": (29.7604, -95.3698),
+    "Phoenix, AZ": (33.4484, -112.0740),
+    "Philadelphia, PA": (39.9526, -75.1652),
+    "San Antonio, TX": (29.4241, -98.4936),
+    "Dallas, TX": (32.7767, -96.7970),
+    "Denver, CO": (39.7392, -104.9903),
+    "Seattle, WA": (47.6062, -122.3321),
+    "Atlanta, GA": (33.7490, -84.3880),
+    "Miami, FL": (25.7617, -80.1918),
+    "Kansas City, MO": (39.0997, -94.5786),
+    "Salt Lake City, UT": (40.7608, -111.8910),
+    "Nashville, TN": (36.1627, -86.7816),
+    "Minneapolis, MN": (44.9778, -93.2650),
+}
+
+
+def fake_coordinates(text: str) -> Tuple[float, float]:
+    """Known city -> its coordinates; anything else -> a stable point inside the contiguous US."""
+    if text in CITIES:
+        return CITIES[text]
+    digest = hashlib.sha1(text.encode("utf-8")).digest()
+    lat = 30.0 + 17.0 * int.from_bytes(digest[:4], "big") / 2 ** 32
+    lon = -120.0 + 44.0 * int.from_bytes(digest[4:8], "big") / 2 ** 32
+    return lat, lon
+
+
+def synthetic_directions(coordinates: List[List[float]], vertices_per_km: float = 1.0) -> dict:
+    """
+    ORS-shaped directions response through [lon, lat] coordinates: a gently wiggling line per leg,
+    with segment distances and way_points like the real API.
+    """
+    points: List[np.ndarray] = []
+    segments = []
+    way_points = [0]
+    for (lon1, lat1), (lon2, lat2) in zip(coordinates, coordinates[1:]):
+        straight_km = _haversine_km(lat1, lon1, lat2, lon2)
+        n = max(2, int(straight_km * vertices_per_km))
+        t = np.linspace(0.0, 1.0, n)
+        # zero at both ends, so way_points land exactly on the stops
+        wiggle = 0.05 * np.sin(np.pi * t) * np.sin(t * straight_km / 15.0)
+        leg = np.column_stack([lat1 + (lat2 - lat1) * t + wiggle, lon1 + (lon2 - lon1) * t - wiggle])
+        points.append(leg if not points else leg[1:])
+        way_points.append(way_points[-1] + n - 1)
+        road_m = straight_km * ROAD_FACTOR * 1000.0
+        segments.append({"distance": road_m, "duration": road_m / 25.0})
+
+    coords = np.concatenate(points) if points else np.empty((0, 2))
+    total_m = sum(s["distance"] for s in segments)
+    return {
+        "routes": [{
+            "summary": {"distance": total_m, "duration": total_m / 25.0},
+            "segments": segments,
+            "geometry": polyline.encode(coords.tolist()),
+            "way_points": way_points,
+        }],
+    }
+
+
+def _haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    a = math.radians(lat2 - lat1)
+    b = math.radians(lon2 - lon1)
+    x = math.sin(a / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(b / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(x))
+
+
+class FakeORSServer:
+    """
+    Threaded HTTP server answering GET /geocode/search and POST /v2/directions/<profile>.
+
+    latency_ms / jitter_ms delay every response; error_rate is the fraction answered with a 503.
+    Recorded responses (ors__geocode*.json keyed by their query text, ors__directions*.json replayed
+    in turn) are served in place of synthetic ones when recorded_dir is given.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        vertices_per_km: float = 1.0,
+        recorded_dir: Optional[Path] = None,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.vertices_per_km = vertices_per_km
+        self.recorded_geocode: Dict[str, dict] = {}
+        self.recorded_directions: List[dict] = []
+        if recorded_dir is not None:
+            self._load_recordings(Path(recorded_dir))
+
+        self.counts: Dict[str, int] = {"geocode": 0, "directions": 0, "errors": 0}
+        self._counts_lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeORSServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-ors", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _load_recordings(self, recorded_dir: Path) -> None:
+        for path in sorted(recorded_dir.glob("ors__geocode*.json")):
+            data = json.loads(path.read_text())
+            text = (data.get("geocoding") or {}).get("query", {}).get("text")
+            if text:
+                self.recorded_geocode[text] = data
+        for path in sorted(recorded_dir.glob("ors__directions*.json")):
+            self.recorded_directions.append(json.loads(path.read_text()))
+
+    def _count(self, key: str) -> None:
+        with self._counts_lock:
+            self.counts[key] += 1
+
+    def _delay_and_maybe_fail(self) -> bool:
+        """Sleep the configured latency; True if this response should be an error."""
+        with self._counts_lock:
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        return fail
+
+    def geocode(self, text: str) -> dict:
+        if text in self.recorded_geocode:
+            return self.recorded_geocode[text]
+        lat, lon = fake_coordinates(text)
+        return {"features": [{"geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": {"label": text}}]}
+
+    def directions(self, coordinates: List[List[float]]) -> dict:
+        if self.recorded_directions:
+            with self._counts_lock:
+                i = self.counts["directions"] % len(self.recorded_directions)
+            return self.recorded_directions[i]
+        return synthetic_directions(coordinates, vertices_per_km=self.vertices_per_km)
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, payload: dict) -> None:
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _fail(self) -> None:
+                server._count("errors")
+                self._send(503, {"error": {"code": 503, "message": "Simulated ORS failure"}})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != "/geocode/search":
+                    self._send(404, {"error": "not found"})
+                    return
+                if server._delay_and_maybe_fail():
+                    self._fail()
+                    return
+                server._count("geocode")
+                text = (parse_qs(url.query).get("text") or [""])[0]
+                self._send(200, server.geocode(text))
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                if not self.path.startswith("/v2/directions/"):
+                    self._send(404, {"error": "not found"})
+                    return
+                try:
+                    coordinates = json.loads(raw)["coordinates"]
+                except (ValueError, KeyError, TypeError):
+                    self._send(400, {"error": {"code": 2000, "message": "Invalid coordinates"}})
+                    return
+                if server._delay_and_maybe_fail():
+                    self._fail()
+                    return
+                server._count("directions")
+                self._send(200, server.directions(coordinates))
+
+        return Handler
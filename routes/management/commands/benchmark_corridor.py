@@ -0,0 +1,135 @@
+import os
+import time
+import tracemalloc
+from typing import List, Optional
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import reset_queries
+
+from routes.fake_ors import CITIES, synthetic_directions
+from routes.services.fuel import FuelStationKDTree, ShardedFuelStationIndex, query_corridor_database
+from routes.services.routing import parse_ors_route_response
+
+
+def _rss_mib() -> Optional[float]:
+    """Current resident set size (Linux); None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _fmt_mib(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:.2f} MiB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare corridor search backends (in-memory KD-tree, per-state shards, database bounding boxes): "
+        "latency and memory"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Timed runs per route and backend (median is reported)"
+        )
+        parser.add_argument(
+            "--radius-deg",
+            type=float,
+            default=0.3,
+            help="Corridor radius in degrees"
+        )
+        parser.add_argument(
+            "--samples",
+            type=int,
+            default=200,
+            help="Route points sampled per corridor query (as get_stations_near_route)"
+        )
+        parser.add_argument(
+            "--shard-budget-mb",
+            type=float,
+            default=0.5,
+            help="Memory budget for the sharded index (small by default so eviction shows up)"
+        )
+
+    def handle(self, *args, **options):
+        names = list(CITIES)
+        routes = []
+        for origin, destination in zip(names, names[1:] + names[:1]):
+            (lat1, lon1), (lat2, lon2) = CITIES[origin], CITIES[destination]
+            points, _ = parse_ors_route_response(synthetic_directions([[lon1, lat1], [lon2, lat2]]))
+            step = max(1, len(points) // options["samples"])
+            routes.append((f"{origin} -> {destination}", points[::step]))
+        radius = options["radius_deg"]
+        repeat = options["repeat"]
+
+        # database backend first, before anything is cached in this process
+        db_ms, db_peak = self._measure(lambda pts: query_corridor_database(pts, radius), routes, repeat)
+        self.stdout.write(
+            f"database: median {np.median(db_ms):7.2f} ms/route (p90 {np.percentile(db_ms, 90):7.2f}), "
+            f"index memory 0 MiB, per-query peak {_fmt_mib(db_peak)}"
+        )
+
+        rss_before = _rss_mib()
+        tracemalloc.start()
+        started = time.perf_counter()
+        index = FuelStationKDTree()
+        index.build()
+        build_s = time.perf_counter() - started
+        retained, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_after = _rss_mib()
+        rss_delta = None if rss_before is None or rss_after is None else rss_after - rss_before
+
+        # first pass fills the tile cache; later passes are the steady state of a warm worker
+        cold_ms, _ = self._measure(lambda pts: index.query_corridor(pts, radius), routes, 1)
+        kd_ms, kd_peak = self._measure(lambda pts: index.query_corridor(pts, radius), routes, repeat)
+        self.stdout.write(
+            f"  kdtree: median {np.median(kd_ms):7.2f} ms/route (p90 {np.percentile(kd_ms, 90):7.2f}, "
+            f"cold tiles {np.median(cold_ms):.2f}), per-query peak {_fmt_mib(kd_peak)}"
+        )
+        self.stdout.write(
+            f"  kdtree index: {index.station_count} stations built in {build_s:.2f}s, "
+            f"retained {_fmt_mib(retained / 2 ** 20)} (Python/NumPy), RSS +{_fmt_mib(rss_delta)}, "
+            f"{len(index._tiles)} cached tiles"
+        )
+
+        sharded = ShardedFuelStationIndex(int(options["shard_budget_mb"] * 2 ** 20))
+        sharded.build()
+        shard_ms, _ = self._measure(lambda pts: sharded.query_corridor(pts, radius), routes, repeat)
+        shards = sharded.shard_status()
+        self.stdout.write(
+            f" sharded: median {np.median(shard_ms):7.2f} ms/route (p90 {np.percentile(shard_ms, 90):7.2f}), "
+            f"{len(shards['resident'])}/{shards['total']} shards resident, "
+            f"{_fmt_mib(shards['memory_bytes'] / 2 ** 20)} of {_fmt_mib(shards['memory_budget_bytes'] / 2 ** 20)}, "
+            f"{shards['loads']} loads, {shards['evictions']} evictions"
+        )
+        self.stdout.write(
+            "The kdtree/sharded timings cover station ids only; get_stations_near_route adds one DB query "
+            "to load those rows, which the database backend already includes."
+        )
+
+    def _measure(self, query, routes, repeat: int):
+        """Median ms per route across `repeat` runs, and the largest tracemalloc peak of a single query."""
+        per_route: List[float] = []
+        peak = 0
+        for _, points in routes:
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                query(points)
+                timings.append((time.perf_counter() - started) * 1000)
+                reset_queries()
+            per_route.append(float(np.median(timings)))
+
+            tracemalloc.start()
+            query(points)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        return per_route, peak / 2 ** 20
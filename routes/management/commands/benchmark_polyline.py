@@ -0,0 +1,83 @@
+import math
+import time
+import tracemalloc
+
+import numpy as np
+import polyline
+from django.core.management.base import BaseCommand
+
+from routes.services.fuel import cumulative_distances_km, haversine_km
+from routes.services.routing import _decode_polyline
+
+
+def synthetic_route(points: int) -> str:
+    """Encoded polyline wandering from Chicago towards Los Angeles with `points` vertices."""
+    t = np.linspace(0.0, 1.0, points)
+    lats = 41.88 + (34.05 - 41.88) * t + 0.4 * np.sin(t * 60)
+    lons = -87.63 + (-118.24 + 87.63) * t + 0.4 * np.cos(t * 45)
+    return polyline.encode(list(zip(lats.tolist(), lons.tolist())))
+
+
+def legacy_decode_and_measure(encoded: str):
+    """Previous path: polyline.decode to a list of tuples, then a per-pair haversine walk."""
+    points = polyline.decode(encoded)
+    out = [0.0]
+    for i in range(1, len(points)):
+        out.append(out[-1] + haversine_km(points[i - 1][0], points[i - 1][1], points[i][0], points[i][1]))
+    return points, out
+
+
+def vectorized_decode_and_measure(encoded: str):
+    points = _decode_polyline(encoded)
+    return points, cumulative_distances_km(points)
+
+
+class Command(BaseCommand):
+    help = "Compare polyline decode + cumulative distance time and peak memory (legacy list path vs NumPy path)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--points",
+            type=int,
+            default=50000,
+            help="Number of route vertices in the synthetic polyline"
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Timed runs per path (best is reported)"
+        )
+
+    def handle(self, *args, **options):
+        encoded = synthetic_route(options["points"])
+        self.stdout.write(f"Encoded polyline: {len(encoded)} chars, {options['points']} vertices")
+
+        results = {}
+        for name, fn in (("legacy", legacy_decode_and_measure), ("numpy", vectorized_decode_and_measure)):
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                fn(encoded)
+                timings.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            points, cumulative = fn(encoded)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = (points, cumulative)
+            self.stdout.write(
+                f"{name:>7}: best {min(timings) * 1000:8.2f} ms, peak memory {peak / 1024 / 1024:7.2f} MiB, "
+                f"route {cumulative[-1]:.1f} km"
+            )
+
+        legacy_points, legacy_km = results["legacy"]
+        numpy_points, numpy_km = results["numpy"]
+        same = np.allclose(np.asarray(legacy_points), numpy_points) and math.isclose(
+            legacy_km[-1], float(numpy_km[-1]), rel_tol=1e-9
+        )
+        if same:
+            self.stdout.write(self.style.SUCCESS("Outputs match."))
+        else:
+            self.stderr.write(self.style.ERROR("Outputs differ between legacy and numpy paths."))
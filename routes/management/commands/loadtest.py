@@ -0,0 +1,325 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from routes.fake_ors import FakeORSServer, fake_coordinates
+
+DEFAULT_LANES = [
+    ("Chicago, IL", "Dallas, TX"),
+    ("New York, NY", "Los Angeles, CA"),
+    ("Seattle, WA", "Denver, CO"),
+    ("Atlanta, GA", "Miami, FL"),
+    ("Houston, TX", "Phoenix, AZ"),
+    ("Kansas City, MO", "Salt Lake City, UT"),
+    ("Philadelphia, PA", "Nashville, TN"),
+    ("Minneapolis, MN", "San Antonio, TX"),
+    ("Chicago, IL", "Kansas City, MO", "Denver, CO"),
+]
+READY_TIMEOUT = 120
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the real app offline: start a fake ORS server, run the app with each worker count, "
+        "drive plan/replan requests and report throughput, latency percentiles and error rates"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            default="1,2,4",
+            help="Comma-separated worker counts to measure"
+        )
+        parser.add_argument(
+            "--server",
+            choices=["runserver", "gunicorn"],
+            default="runserver",
+            help="runserver: one single-threaded runserver process per worker; gunicorn: gunicorn -w N (must be installed)"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="Concurrent client connections"
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=200,
+            help="Requests per worker count"
+        )
+        parser.add_argument(
+            "--replan-ratio",
+            type=float,
+            default=0.2,
+            help="Fraction of requests that replan an already planned trip"
+        )
+        parser.add_argument(
+            "--lanes",
+            type=Path,
+            help="JSON file with [[origin, ..., destination], ...]; lanes with more than two stops are multi-waypoint plans (default: built-in city pairs)"
+        )
+        parser.add_argument(
+            "--ors-latency-ms",
+            type=float,
+            default=100.0,
+            help="Fake ORS response latency"
+        )
+        parser.add_argument(
+            "--ors-jitter-ms",
+            type=float,
+            default=20.0,
+            help="Uniform +/- jitter on the fake ORS latency"
+        )
+        parser.add_argument(
+            "--ors-error-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of fake ORS responses that are 503s"
+        )
+        parser.add_argument(
+            "--vertices-per-km",
+            type=float,
+            default=1.0,
+            help="Polyline density of synthetic routes"
+        )
+        parser.add_argument(
+            "--recorded-dir",
+            type=Path,
+            help="Directory of recorded ORS responses (ors__geocode*.json / ors__directions*.json)"
+        )
+        parser.add_argument(
+            "--base-port",
+            type=int,
+            default=8800,
+            help="First port for app servers"
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed for the request mix and fake ORS"
+        )
+        parser.add_argument(
+            "--json-out",
+            type=Path,
+            help="Also write the results to this JSON file"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            worker_counts = [int(w) for w in options["workers"].split(",") if w.strip()]
+        except ValueError:
+            raise CommandError("--workers must be comma-separated integers")
+        lanes = DEFAULT_LANES
+        if options["lanes"]:
+            lanes = [tuple(lane) for lane in json.loads(options["lanes"].read_text())]
+
+        fake = FakeORSServer(
+            latency_ms=options["ors_latency_ms"],
+            jitter_ms=options["ors_jitter_ms"],
+            error_rate=options["ors_error_rate"],
+            vertices_per_km=options["vertices_per_km"],
+            recorded_dir=options["recorded_dir"],
+            seed=options["seed"],
+        ).start()
+        self.stdout.write(f"Fake ORS at {fake.base_url}")
+
+        results = []
+        try:
+            for workers in worker_counts:
+                procs, urls = self._start_servers(options["server"], workers, options["base_port"], fake.base_url)
+                try:
+                    self._wait_ready(urls, procs, workers)
+                    started = time.perf_counter()
+                    samples = _drive(
+                        urls,
+                        lanes,
+                        total=options["requests"],
+                        concurrency=options["concurrency"],
+                        replan_ratio=options["replan_ratio"],
+                        seed=options["seed"],
+                    )
+                    elapsed = time.perf_counter() - started
+                finally:
+                    _stop_servers(procs)
+                row = _summarize(workers, samples, elapsed)
+                results.append(row)
+                self._print_row(row)
+        finally:
+            fake.stop()
+
+        self.stdout.write(
+            f"Fake ORS served {fake.counts['geocode']} geocode, {fake.counts['directions']} directions, "
+            f"{fake.counts['errors']} simulated errors"
+        )
+        if options["json_out"]:
+            options["json_out"].write_text(json.dumps(results, indent=2))
+            self.stdout.write(f"Wrote {options['json_out']}")
+
+    def _start_servers(self, server: str, workers: int, base_port: int, ors_url: str):
+        env = dict(os.environ)
+        env.update({
+            "ORS_BASE_URL": ors_url,
+            "ORS_API_KEY": env.get("ORS_API_KEY") or "loadtest",
+            "DJANGO_DEBUG": "False",
+            "DJANGO_ALLOWED_HOSTS": "127.0.0.1,localhost",
+        })
+        manage_py = str(Path(settings.BASE_DIR) / "manage.py")
+        if server == "gunicorn":
+            # the master builds the index before forking, so every worker starts with it warm
+            env["FUEL_INDEX_PRELOAD"] = "True"
+            cmd = [
+                sys.executable, "-m", "gunicorn", "fuel_route_planner.wsgi:application",
+                "-w", str(workers), "-b", f"127.0.0.1:{base_port}", "--preload",
+            ]
+            procs = [subprocess.Popen(cmd, cwd=settings.BASE_DIR, env=env,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)]
+            return procs, [f"http://127.0.0.1:{base_port}"]
+
+        procs, urls = [], []
+        for i in range(workers):
+            port = base_port + i
+            cmd = [sys.executable, manage_py, "runserver", "--noreload", "--nothreading", f"127.0.0.1:{port}"]
+            procs.append(subprocess.Popen(cmd, cwd=settings.BASE_DIR, env=env,
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+            urls.append(f"http://127.0.0.1:{port}")
+        return procs, urls
+
+    def _wait_ready(self, urls: List[str], procs, workers: int) -> None:
+        """
+        Poll /api/ready/ until every URL answers 200. One gunicorn URL fronts all its workers, but with
+        --preload they are forked from a master that already built the index, so one 200 covers them.
+        """
+        deadline = time.monotonic() + READY_TIMEOUT
+        for url in urls:
+            while True:
+                if any(p.poll() is not None for p in procs):
+                    raise CommandError(f"App server exited early (workers={workers})")
+                if time.monotonic() > deadline:
+                    raise CommandError(f"App servers not ready after {READY_TIMEOUT}s (workers={workers})")
+                try:
+                    if requests.get(f"{url}/api/ready/", timeout=2).status_code == 200:
+                        break
+                except requests.RequestException:
+                    pass
+                time.sleep(0.2)
+
+    def _print_row(self, row: dict) -> None:
+        self.stdout.write(
+            f"workers={row['workers']:>3}  requests={row['requests']:>5}  "
+            f"throughput={row['throughput_rps']:8.1f} req/s  "
+            f"p50={row['p50_ms']:8.1f}  p90={row['p90_ms']:8.1f}  p99={row['p99_ms']:8.1f} ms  "
+            f"errors={row['errors']} ({row['error_rate'] * 100:.1f}%)"
+        )
+        for kind, stats in row["by_kind"].items():
+            self.stdout.write(
+                f"    {kind:<7} n={stats['requests']:>5}  p50={stats['p50_ms']:8.1f}  "
+                f"p99={stats['p99_ms']:8.1f} ms  errors={stats['errors']}"
+            )
+
+
+def _drive(
+    urls: List[str],
+    lanes: List[Tuple[str, ...]],
+    total: int,
+    concurrency: int,
+    replan_ratio: float,
+    seed: int,
+) -> List[Tuple[str, int, float]]:
+    """Send `total` requests with `concurrency` client threads; returns (kind, status, seconds) per request (status 0 = no response)."""
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+    planned: List[Tuple[int, Tuple[str, ...]]] = []
+    local = threading.local()
+
+    def one(i: int) -> Tuple[str, int, float]:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        base = urls[i % len(urls)]
+        with rng_lock:
+            if planned and rng.random() < replan_ratio:
+                plan_id, lane = rng.choice(planned)
+                kind = "replan"
+                (lat1, lon1), (lat2, lon2) = fake_coordinates(lane[0]), fake_coordinates(lane[-1])
+                t = rng.uniform(0.1, 0.9)
+                params = {
+                    "plan_id": plan_id,
+                    "lat": lat1 + (lat2 - lat1) * t,
+                    "lon": lon1 + (lon2 - lon1) * t,
+                    "fuel_level": round(rng.uniform(0.05, 1.0), 2),
+                }
+            else:
+                lane = rng.choice(lanes)
+                kind = "plan"
+                if len(lane) > 2:
+                    params = {"waypoints": list(lane)}
+                else:
+                    params = {"origin": lane[0], "destination": lane[1]}
+
+        url = f"{base}/api/{kind}-route/"
+        started = time.perf_counter()
+        try:
+            resp = local.session.get(url, params=params, timeout=60)
+            status = resp.status_code
+        except requests.RequestException:
+            return kind, 0, time.perf_counter() - started
+        elapsed = time.perf_counter() - started
+        if kind == "plan" and status == 200:
+            with rng_lock:
+                planned.append((resp.json()["plan_id"], lane))
+        return kind, status, elapsed
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(total)))
+
+
+def _stop_servers(procs) -> None:
+    for p in procs:
+        p.terminate()
+    for p in procs:
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+
+def _latency_stats(samples: List[Tuple[str, int, float]]) -> Dict[str, float]:
+    ms = np.asarray([s[2] for s in samples]) * 1000.0
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99]) if ms.size else (0.0, 0.0, 0.0)
+    errors = sum(1 for _, status, _ in samples if not 200 <= status < 300)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": errors / len(samples) if samples else 0.0,
+        "p50_ms": float(p50),
+        "p90_ms": float(p90),
+        "p99_ms": float(p99),
+        "max_ms": float(ms.max()) if ms.size else 0.0,
+    }
+
+
+def _summarize(workers: int, samples: List[Tuple[str, int, float]], elapsed: float) -> dict:
+    row = {"workers": workers, "seconds": elapsed, **_latency_stats(samples)}
+    row["throughput_rps"] = len(samples) / elapsed if elapsed > 0 else 0.0
+    statuses: Dict[str, int] = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    row["statuses"] = statuses
+    row["by_kind"] = {
+        kind: _latency_stats([s for s in samples if s[0] == kind])
+        for kind in sorted({s[0] for s in samples})
+    }
+    return row
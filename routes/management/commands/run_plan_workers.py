@@ -0,0 +1,132 @@
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from routes.services.fuel import ensure_fuel_station_index_built
+from routes.services.jobs import claim_next_job, queue_stats, requeue_stale_jobs, run_job
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_loop(name: str, poll_interval: float, exit_when_empty: bool, max_jobs: int) -> None:
+    """
+    Child process: claim and run jobs until stopped (or the queue drains with exit_when_empty).
+    A failing iteration (e.g. "database is locked" while claiming or saving) is logged and retried
+    after poll_interval instead of ending the process; a job whose result could not be saved stays
+    running until requeue_stale_jobs puts it back.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    done = 0
+    while not max_jobs or done < max_jobs:
+        try:
+            job = claim_next_job(name)
+            if job is None:
+                if exit_when_empty:
+                    break
+                time.sleep(poll_interval)
+                continue
+            job = run_job(job)
+        except Exception:
+            logger.exception("[%s] worker iteration failed, retrying in %.1fs", name, poll_interval)
+            # drop a connection the error may have left unusable; the next query opens a fresh one
+            connections.close_all()
+            time.sleep(poll_interval)
+            continue
+        done += 1
+        logger.info("[%s] job %s %s in %.2fs", name, job.id, job.status, job.run_seconds)
+
+
+class Command(BaseCommand):
+    help = "Run a pool of worker processes executing queued plan jobs (see POST /api/plan-jobs/)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Worker processes (default: number of cores)"
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=0.5,
+            help="Seconds an idle worker waits before polling the queue again"
+        )
+        parser.add_argument(
+            "--exit-when-empty",
+            action="store_true",
+            help="Stop each worker once the queue is empty (batch runs)"
+        )
+        parser.add_argument(
+            "--max-jobs",
+            type=int,
+            default=0,
+            help="Jobs per worker before it exits (0 = no limit)"
+        )
+        parser.add_argument(
+            "--requeue-after",
+            type=float,
+            default=600,
+            help="On start, requeue jobs stuck running longer than this many seconds (0 = off)"
+        )
+
+    def handle(self, *args, **options):
+        if options["requeue_after"]:
+            requeued = requeue_stale_jobs(options["requeue_after"])
+            if requeued:
+                self.stdout.write(self.style.WARNING(f"Requeued {requeued} stale running jobs."))
+
+        # Build the station index once here; forked workers share this snapshot copy-on-write
+        # instead of each loading the stations and building its own tree. With FUEL_INDEX_MODE =
+        # "sharded" only the shard manifest is shared; each worker loads the shards its jobs need.
+        # The database corridor backend plans without an index, so none is built.
+        if getattr(settings, "FUEL_CORRIDOR_BACKEND", "kdtree") == "database":
+            self.stdout.write("Station index: not built (FUEL_CORRIDOR_BACKEND=database)")
+        else:
+            started = time.perf_counter()
+            index = ensure_fuel_station_index_built(cold_policy="wait")
+            self.stdout.write(
+                f"Station index: {index.station_count} stations, version {index.data_version}, "
+                f"built in {time.perf_counter() - started:.2f}s"
+            )
+        # children must open their own DB connections
+        connections.close_all()
+
+        ctx = multiprocessing.get_context("fork")
+        host = socket.gethostname()
+        procs = []
+        for i in range(options["processes"]):
+            name = f"{host}:{os.getpid()}:{i}"
+            proc = ctx.Process(
+                target=_worker_loop,
+                args=(name, options["poll_interval"], options["exit_when_empty"], options["max_jobs"]),
+                name=name,
+            )
+            proc.start()
+            procs.append(proc)
+        self.stdout.write(f"Started {len(procs)} workers.")
+
+        started = time.perf_counter()
+        try:
+            for proc in procs:
+                proc.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers...")
+            for proc in procs:
+                proc.terminate()
+            for proc in procs:
+                proc.join()
+
+        stats = queue_stats()
+        self.stdout.write(
+            f"Workers stopped after {time.perf_counter() - started:.1f}s. Queue depth {stats['depth']}, "
+            f"counts {stats['counts']}, run p50 {stats['run_seconds']['p50']}s"
+        )
@@ -0,0 +1,33 @@
+# Generated by Django 6.0.2 on 2026-10-19 06:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoutePlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('origin', models.CharField(max_length=255)),
+                ('destination', models.CharField(max_length=255)),
+                ('polyline', models.JSONField()),
+                ('total_km', models.FloatField()),
+                ('candidates', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterModelOptions(
+            name='fuelstation',
+            options={'ordering': ['state', 'city', 'retail_price']},
+        ),
+        migrations.AddIndex(
+            model_name='fuelstation',
+            index=models.Index(fields=['state', 'retail_price'], name='routes_fuel_state_8123d0_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.2 on 2026-10-19 06:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0003_planjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fuelstation',
+            index=models.Index(fields=['latitude', 'longitude'], name='routes_fuel_latitud_203dad_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-19 06:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routes', '0004_fuelstation_lat_lon_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='planjob',
+            name='waypoints',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='routeplan',
+            name='legs',
+            field=models.JSONField(default=list),
+        ),
+        migrations.AddField(
+            model_name='routeplan',
+            name='waypoints',
+            field=models.JSONField(default=list),
+        ),
+    ]
@@ -17,7 +17,79 @@ class FuelStation(models.Model):
         ordering = ["state", "city", "retail_price"]
         indexes = [
             models.Index(fields=["state", "retail_price"]),
+            # bounding-box lookups for the database corridor backend
+            models.Index(fields=["latitude", "longitude"]),
         ]
 
     def __str__(self):
         return f"{self.truck_stop_name} ({self.city}, {self.state})"
+
+
+class RoutePlan(models.Model):
+    """A computed route plan, kept so the trip can be replanned without upstream calls."""
+
+    origin = models.CharField(max_length=255)
+    destination = models.CharField(max_length=255)
+    # every stop in order, origin and destination included
+    waypoints = models.JSONField(default=list)
+    polyline = models.JSONField()
+    total_km = models.FloatField()
+    legs = models.JSONField(default=list)
+    # [[station_id, km_along_route], ...] for every corridor station found at plan time
+    candidates = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.origin} -> {self.destination} ({self.total_km:.0f} km)"
+
+
+class PlanJob(models.Model):
+    """A queued plan request, executed by `manage.py run_plan_workers` and polled by job id."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    origin = models.CharField(max_length=255)
+    destination = models.CharField(max_length=255)
+    # every stop in order when the trip has intermediate stops; empty for origin -> destination
+    waypoints = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+    worker = models.CharField(max_length=64, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["finished_at"]),
+        ]
+
+    def __str__(self):
+        return f"PlanJob {self.id} [{self.status}] {self.origin} -> {self.destination}"
+
+    @property
+    def stops(self):
+        return self.waypoints or [self.origin, self.destination]
+
+    @property
+    def queue_seconds(self):
+        if self.started_at is None:
+            return None
+        return (self.started_at - self.created_at).total_seconds()
+
+    @property
+    def run_seconds(self):
+        if self.started_at is None or self.finished_at is None:
+            return None
+        return (self.finished_at - self.started_at).total_seconds()
@@ -1,14 +1,34 @@
 #  Fuel data loader + KD-tree lookup
+import hashlib
+import itertools
+import logging
 import math
-from typing import List, Tuple, Optional
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Optional
 
 import numpy as np
 
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, Max, Min, Q, Sum
 from scipy.spatial import KDTree
 
 from routes.models import FuelStation
 
+logger = logging.getLogger(__name__)
+
 EARTH_RADIUS_KM = 6371.0
+KM_PER_DEG = math.radians(1) * EARTH_RADIUS_KM
+TILE_SIZE_DEG = 0.5
+# points per radius query when ranking the cheapest stations around them (bounds the candidate arrays)
+NEARBY_CHUNK_POINTS = 256
+# consecutive route points covered by one bounding box in the database corridor backend
+CORRIDOR_CHUNK_POINTS = 20
 
 
 def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
@@ -19,48 +39,141 @@ def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(x))
 
 
-def cumulative_distances_km(points: List[Tuple[float, float]]) -> List[float]:
-    """Cumulative distance in km from first point. Returns [0, d01, d01+d12, ...]."""
-    if not points:
-        return []
-    if len(points) == 1:
-        return [0.0]
-    out = [0.0]
-    for i in range(1, len(points)):
-        d = haversine_km(points[i - 1][0], points[i - 1][1], points[i][0], points[i][1])
-        out.append(out[-1] + d)
+def haversine_km_array(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Vectorized haversine_km over NumPy arrays (broadcasts)."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    x = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(x))
+
+
+def cumulative_distances_km(points) -> np.ndarray:
+    """Cumulative distance in km from first point. Returns [0, d01, d01+d12, ...]; points is (n, 2) (lat, lon)."""
+    coords = np.asarray(points, dtype=float).reshape(-1, 2)
+    out = np.zeros(len(coords))
+    if len(coords) > 1:
+        steps = haversine_km_array(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1])
+        np.cumsum(steps, out=out[1:])
     return out
 
 
+def snap_to_route(
+    lat: float,
+    lon: float,
+    polyline_points,
+    cumulative_km,
+) -> Tuple[float, float]:
+    """
+    Project (lat, lon) onto the nearest polyline segment.
+    Returns (km along route, km off route). Uses a local flat-earth approximation around the point.
+    """
+    coords = np.asarray(polyline_points, dtype=float)
+    cum = np.asarray(cumulative_km, dtype=float)
+    if len(coords) == 1:
+        return 0.0, haversine_km(lat, lon, coords[0, 0], coords[0, 1])
+
+    y = (coords[:, 0] - lat) * KM_PER_DEG
+    x = (coords[:, 1] - lon) * KM_PER_DEG * math.cos(math.radians(lat))
+    ax, ay = x[:-1], y[:-1]
+    dx, dy = x[1:] - ax, y[1:] - ay
+    seg_sq = dx * dx + dy * dy
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(seg_sq > 0, -(ax * dx + ay * dy) / seg_sq, 0.0)
+    t = np.clip(t, 0.0, 1.0)
+    px, py = ax + t * dx, ay + t * dy
+    dist_sq = px * px + py * py
+
+    i = int(np.argmin(dist_sq))
+    km = cum[i] + t[i] * (cum[i + 1] - cum[i])
+    return float(km), float(math.sqrt(dist_sq[i]))
+
+
 class FuelStationKDTree:
     def __init__(self) -> None:
         self._tree: Optional[KDTree] = None
         self._coords: Optional[np.ndarray] = None
         self._station_ids: Optional[List[int]] = None
+        self._prices: Optional[np.ndarray] = None
+        self._names: Optional[List[str]] = None
+        self.station_count = 0
+        self.build_seconds: Optional[float] = None
+        self.data_version: Optional[str] = None
+        # (tile row, tile col, radius_deg) -> station indices within radius_deg of that tile
+        self._tiles: Dict[Tuple[int, int, float], np.ndarray] = {}
+        self.tile_hits = 0
+        self.tile_misses = 0
+        # bytes held by the id and name lists, measured once per build
+        self._list_bytes = 0
 
-    def build(self) -> None:
-        """Build KD-tree from all stations with valid coordinates."""
+    def build(self, state: Optional[str] = None) -> None:
+        """Build KD-tree from all stations with valid coordinates (only those in `state`, if given)."""
+        started = time.perf_counter()
         qs = FuelStation.objects.filter(latitude__isnull=False, longitude__isnull=False)
-        if not qs.exists():
-            self._tree = None
-            self._coords = None
-            self._station_ids = None
-            return
+        if state is not None:
+            qs = qs.filter(state=state)
+        qs = qs.order_by("id").values_list("id", "latitude", "longitude", "retail_price", "truck_stop_name")
 
         coords: List[Tuple[float, float]] = []
         station_ids: List[int] = []
+        prices: List[float] = []
+        names: List[str] = []
 
-        for station in qs.iterator(chunk_size=2000):
-            coords.append((station.latitude, station.longitude))
-            station_ids.append(station.id)
+        for station_id, lat, lon, price, name in qs.iterator(chunk_size=2000):
+            coords.append((lat, lon))
+            station_ids.append(station_id)
+            prices.append(float(price))
+            names.append(name)
 
-        self._coords = np.asarray(coords, dtype=float)
-        self._station_ids = station_ids
-        self._tree = KDTree(self._coords)
+        self.set_columns(station_ids, coords, prices, names)
+        self.build_seconds = time.perf_counter() - started
+
+    def set_columns(
+        self,
+        station_ids: List[int],
+        coords: List[Tuple[float, float]],
+        prices: List[float],
+        names: List[str],
+    ) -> None:
+        """Index the given stations (build() loads them from the DB) and reset the tile cache."""
+        self._tiles = {}
+        self.station_count = len(station_ids)
+        if not station_ids:
+            self._tree = None
+            self._coords = None
+            self._station_ids = None
+            self._prices = None
+            self._names = None
+            self._list_bytes = 0
+            self.data_version = "empty"
+        else:
+            self._coords = np.asarray(coords, dtype=float)
+            self._station_ids = station_ids
+            self._prices = np.asarray(prices, dtype=float)
+            self._names = names
+            self._tree = KDTree(self._coords)
+            digest = hashlib.sha1(np.asarray(station_ids, dtype=np.int64).tobytes())
+            digest.update(self._coords.tobytes())
+            digest.update(self._prices.tobytes())
+            self.data_version = digest.hexdigest()[:12]
+            self._list_bytes = (
+                sys.getsizeof(station_ids) + sum(sys.getsizeof(i) for i in station_ids)
+                + sys.getsizeof(names) + sum(sys.getsizeof(n) for n in names)
+            )
 
     def is_ready(self) -> bool:
         return self._tree is not None
 
+    def tile_stats(self) -> dict:
+        """Corridor tile cache: cached tiles and lookups served from / added to it since build()."""
+        return {"tiles": len(self._tiles), "hits": self.tile_hits, "misses": self.tile_misses}
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held: column arrays, id/name lists, the tree's arrays and cached tiles."""
+        if self._tree is None:
+            return 0
+        tree_bytes = self._tree.data.nbytes + self._tree.indices.nbytes
+        tile_bytes = sum(members.nbytes for members in list(self._tiles.values()))
+        return self._coords.nbytes + self._prices.nbytes + self._list_bytes + tree_bytes + tile_bytes
+
     def query_within_radius(self, lat: float, lon:float, radius_deg: float) -> List[FuelStation]:
         """Return all stations within radius_deg (degrees) of lat and lon.
             This is a an approximation; for more precise distance units, I need to convert my desired km/miles
@@ -75,45 +188,579 @@ class FuelStationKDTree:
         # Optional: need to sort by true distance or price for order
         return stations
 
+    def _tile_members(self, row: int, col: int, radius_deg: float) -> np.ndarray:
+        """Indices of stations within radius_deg of tile (row, col); computed once per tile and radius."""
+        key = (row, col, radius_deg)
+        members = self._tiles.get(key)
+        if members is not None:
+            self.tile_hits += 1
+            return members
+        self.tile_misses += 1
+
+        lat0, lon0 = row * TILE_SIZE_DEG, col * TILE_SIZE_DEG
+        center = [lat0 + TILE_SIZE_DEG / 2, lon0 + TILE_SIZE_DEG / 2]
+        indices = np.asarray(
+            self._tree.query_ball_point(center, r=TILE_SIZE_DEG * math.sqrt(2) / 2 + radius_deg),
+            dtype=np.intp,
+        )
+        # trim the circumscribing ball down to the tile box grown by radius_deg
+        pts = self._coords[indices]
+        dlat = np.maximum(0.0, np.maximum(lat0 - pts[:, 0], pts[:, 0] - (lat0 + TILE_SIZE_DEG)))
+        dlon = np.maximum(0.0, np.maximum(lon0 - pts[:, 1], pts[:, 1] - (lon0 + TILE_SIZE_DEG)))
+        members = indices[dlat * dlat + dlon * dlon <= radius_deg * radius_deg]
+        self._tiles[key] = members
+        return members
+
+    def query_corridor(self, points, radius_deg: float) -> List[int]:
+        """
+        Return ids of stations within radius_deg of any of points.
+        Points are mapped to TILE_SIZE_DEG tiles; cached tile members are unioned, then filtered by exact distance.
+        """
+        if self._tree is None or self._coords is None or self._station_ids is None:
+            raise RuntimeError("FuelStationKDTree not built. Call build() first")
+
+        pts = np.asarray(points, dtype=float).reshape(-1, 2)
+        if not len(pts):
+            return []
+        tiles = np.unique(np.floor(pts / TILE_SIZE_DEG).astype(np.int64), axis=0)
+        members = np.unique(np.concatenate([
+            self._tile_members(int(row), int(col), radius_deg) for row, col in tiles
+        ]))
+        if not members.size:
+            return []
+
+        dist, _ = KDTree(pts).query(self._coords[members], distance_upper_bound=radius_deg)
+        return [self._station_ids[i] for i in members[np.isfinite(dist)]]
+
+    def cheapest_near(
+        self,
+        points,
+        radius_km: float,
+        k: int = 5,
+        detour_cost_per_km: float = 0.0,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Top-k stations per point ranked by price + detour_cost_per_km * distance_km, among every
+        station within radius_km (ties: nearer first). Points are answered NEARBY_CHUNK_POINTS at a
+        time, each chunk with one vectorized radius query.
+        Returns (indices, distance_km, score), each (n_points, k); empty slots have index -1.
+        """
+        if self._tree is None or self._coords is None or self._station_ids is None:
+            raise RuntimeError("FuelStationKDTree not built. Call build() first")
+
+        pts = np.asarray(points, dtype=float).reshape(-1, 2)
+        k = min(k, len(self._station_ids))
+        top = np.full((len(pts), k), -1, dtype=np.intp)
+        top_dist = np.full((len(pts), k), np.inf)
+        top_score = np.full((len(pts), k), np.inf)
+
+        for start in range(0, len(pts), NEARBY_CHUNK_POINTS):
+            chunk = pts[start:start + NEARBY_CHUNK_POINTS]
+            balls = self._tree.query_ball_point(chunk, r=_radius_deg_for_km(chunk, radius_km), workers=-1)
+            counts = np.fromiter((len(ball) for ball in balls), dtype=np.intp, count=len(balls))
+            idx = np.fromiter(itertools.chain.from_iterable(balls), dtype=np.intp, count=int(counts.sum()))
+            row = np.repeat(np.arange(len(chunk)), counts)
+
+            dist = haversine_km_array(chunk[row, 0], chunk[row, 1], self._coords[idx, 0], self._coords[idx, 1])
+            inside = dist <= radius_km
+            idx, row, dist = idx[inside], row[inside], dist[inside]
+            score = self._prices[idx] + detour_cost_per_km * dist
+
+            # by point, then score, distance and station index
+            order = np.lexsort((idx, dist, score, row))
+            idx, row, dist, score = idx[order], row[order], dist[order], score[order]
+            rank = np.arange(len(row)) - np.searchsorted(row, row, side="left")
+            best = rank < k
+            out_row, out_rank = start + row[best], rank[best]
+            top[out_row, out_rank] = idx[best]
+            top_dist[out_row, out_rank] = dist[best]
+            top_score[out_row, out_rank] = score[best]
+        return top, top_dist, top_score
+
+    def cheapest_near_stations(
+        self,
+        points,
+        radius_km: float,
+        k: int = 5,
+        detour_cost_per_km: float = 0.0,
+    ) -> List[List[dict]]:
+        """cheapest_near as one list of station dicts per point, best score first."""
+        top, dist, score = self.cheapest_near(points, radius_km, k=k, detour_cost_per_km=detour_cost_per_km)
+        safe = np.where(top >= 0, top, 0)
+        columns = zip(
+            top.tolist(),
+            self._prices[safe].tolist(),
+            self._coords[safe, 0].tolist(),
+            self._coords[safe, 1].tolist(),
+            dist.tolist(),
+            score.tolist(),
+        )
+        ids, names = self._station_ids, self._names
+        return [
+            [
+                {
+                    "id": ids[i],
+                    "name": names[i],
+                    "price": price,
+                    "lat": lat,
+                    "lon": lon,
+                    "distance_km": d,
+                    "score": sc,
+                }
+                for i, price, lat, lon, d, sc in zip(*row)
+                if i >= 0
+            ]
+            for row in columns
+        ]
+
+
+def _radius_deg_for_km(pts: np.ndarray, radius_km: float) -> float:
+    """
+    Degree radius covering radius_km around every point: sized for the narrowest longitude degree
+    any station within radius_km of the batch can sit at.
+    """
+    if not len(pts):
+        return radius_km / KM_PER_DEG
+    max_lat = min(float(np.abs(pts[:, 0]).max()) + radius_km / KM_PER_DEG, 90.0)
+    return radius_km / (KM_PER_DEG * max(math.cos(math.radians(max_lat)), 0.01))
+
+
+class ShardedFuelStationIndex:
+    """
+    Station index partitioned by state. Only a manifest of per-state bounding boxes is loaded up
+    front; each state's FuelStationKDTree is built the first time a query comes near its box, and
+    the least recently used shards are dropped once resident shards exceed memory_budget_bytes.
+    Same query interface as FuelStationKDTree (station ids / station dicts, no local indices).
+    """
+
+    def __init__(self, memory_budget_bytes: int) -> None:
+        self.memory_budget_bytes = memory_budget_bytes
+        self._shard_names: List[str] = []
+        # (n_shards, 4): lat_min, lat_max, lon_min, lon_max
+        self._boxes: Optional[np.ndarray] = None
+        self._resident: "OrderedDict[str, FuelStationKDTree]" = OrderedDict()
+        self._reset_locks()
+        self.station_count = 0
+        self.build_seconds: Optional[float] = None
+        self.data_version: Optional[str] = None
+        self.shard_loads = 0
+        self.shard_evictions = 0
+
+    def _reset_locks(self) -> None:
+        """Fresh lock and bookkeeping (also after fork: the threads that held them are gone)."""
+        # guards _resident, _loading and _pins; never held across a DB query
+        self._shard_lock = threading.Lock()
+        # shard name -> set once the thread building it is done
+        self._loading: Dict[str, threading.Event] = {}
+        # shard name -> running queries using it; pinned shards are not evicted
+        self._pins: Counter = Counter()
+
+    def build(self) -> None:
+        """Load the shard manifest with one aggregate query; no station rows are read."""
+        started = time.perf_counter()
+        rows = list(
+            FuelStation.objects.filter(latitude__isnull=False, longitude__isnull=False)
+            .values("state")
+            .annotate(
+                n=Count("id"),
+                max_id=Max("id"),
+                price_sum=Sum("retail_price"),
+                lat_min=Min("latitude"),
+                lat_max=Max("latitude"),
+                lon_min=Min("longitude"),
+                lon_max=Max("longitude"),
+            )
+            .order_by("state")
+        )
+        with self._shard_lock:
+            self._resident = OrderedDict()
+        self._shard_names = [row["state"] for row in rows]
+        self._boxes = np.asarray(
+            [(row["lat_min"], row["lat_max"], row["lon_min"], row["lon_max"]) for row in rows], dtype=float
+        ).reshape(-1, 4)
+        self.station_count = sum(row["n"] for row in rows)
+        digest = hashlib.sha1()
+        for row in rows:
+            digest.update(f"{row['state']}:{row['n']}:{row['max_id']}:{row['price_sum']}".encode())
+        digest.update(self._boxes.tobytes())
+        self.data_version = digest.hexdigest()[:12] if rows else "empty"
+        self.build_seconds = time.perf_counter() - started
+
+    def is_ready(self) -> bool:
+        return bool(self._shard_names)
+
+    def _near_boxes(self, pts: np.ndarray, radius_deg: float) -> np.ndarray:
+        """(n_shards, n_points) mask: point within radius_deg of the shard's bounding box."""
+        lat, lon = pts[:, 0], pts[:, 1]
+        boxes = self._boxes
+        dlat = np.maximum(0.0, np.maximum(boxes[:, [0]] - lat, lat - boxes[:, [1]]))
+        dlon = np.maximum(0.0, np.maximum(boxes[:, [2]] - lon, lon - boxes[:, [3]]))
+        return dlat * dlat + dlon * dlon <= radius_deg * radius_deg
+
+    def _shard(self, i: int) -> FuelStationKDTree:
+        """
+        Shard i, marked most recently used. A missing shard is built outside _shard_lock, so queries
+        on resident shards never wait for it; concurrent callers for the same shard wait for one build.
+        """
+        name = self._shard_names[i]
+        while True:
+            with self._shard_lock:
+                shard = self._resident.get(name)
+                if shard is not None:
+                    self._resident.move_to_end(name)
+                    return shard
+                loading = self._loading.get(name)
+                if loading is None:
+                    loading = self._loading[name] = threading.Event()
+                    break
+            # another thread is building it: wait, then look again (and build it ourselves if that failed)
+            loading.wait()
+
+        shard = FuelStationKDTree()
+        built = False
+        try:
+            shard.build(state=name)
+            built = True
+        finally:
+            with self._shard_lock:
+                del self._loading[name]
+                if built:
+                    self._resident[name] = shard
+                    self.shard_loads += 1
+                    self._evict()
+            loading.set()
+        return shard
+
+    def _evict(self) -> None:
+        """Drop least recently used unpinned shards until within budget. Caller holds _shard_lock."""
+        sizes = {name: shard.memory_bytes() for name, shard in self._resident.items()}
+        used = sum(sizes.values())
+        for name in list(self._resident):
+            if used <= self.memory_budget_bytes:
+                break
+            if self._pins[name] > 0:
+                continue
+            del self._resident[name]
+            used -= sizes[name]
+            self.shard_evictions += 1
+            logger.info("Evicted fuel station shard %s (%d bytes)", name, sizes[name])
+
+    @contextmanager
+    def _pinned(self, names: List[str]):
+        """
+        Keep these shards resident while a query uses them (it may need more than the budget holds),
+        then bring resident shards back within budget once it is done.
+        """
+        with self._shard_lock:
+            self._pins.update(names)
+        try:
+            yield
+        finally:
+            with self._shard_lock:
+                self._pins.subtract(names)
+                for name in names:
+                    if self._pins[name] <= 0:
+                        del self._pins[name]
+                self._evict()
+
+    def _shards_near(self, pts: np.ndarray, radius_deg: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Indices of shards whose box is within radius_deg of some point, and the (n_shards, n_points) mask."""
+        near = self._near_boxes(pts, radius_deg)
+        return np.flatnonzero(near.any(axis=1)), near
+
+    def query_corridor(self, points, radius_deg: float) -> List[int]:
+        """Ids of stations within radius_deg of any of points, from the shards the route comes near."""
+        if not self.is_ready():
+            raise RuntimeError("ShardedFuelStationIndex not built. Call build() first")
+
+        pts = np.asarray(points, dtype=float).reshape(-1, 2)
+        if not len(pts):
+            return []
+        selected, near = self._shards_near(pts, radius_deg)
+        ids: List[int] = []
+        with self._pinned([self._shard_names[i] for i in selected]):
+            for i in selected:
+                shard = self._shard(int(i))
+                if shard.is_ready():
+                    ids.extend(shard.query_corridor(pts[near[i]], radius_deg))
+        return ids
+
+    def cheapest_near_stations(
+        self,
+        points,
+        radius_km: float,
+        k: int = 5,
+        detour_cost_per_km: float = 0.0,
+    ) -> List[List[dict]]:
+        """Per point, up to k station dicts best score first, merged across the shards near it."""
+        if not self.is_ready():
+            raise RuntimeError("ShardedFuelStationIndex not built. Call build() first")
+
+        pts = np.asarray(points, dtype=float).reshape(-1, 2)
+        results: List[List[dict]] = [[] for _ in range(len(pts))]
+        if not len(pts):
+            return results
+        selected, near = self._shards_near(pts, _radius_deg_for_km(pts, radius_km))
+        merged = False
+        with self._pinned([self._shard_names[i] for i in selected]):
+            for i in selected:
+                shard = self._shard(int(i))
+                if not shard.is_ready():
+                    continue
+                rows = np.flatnonzero(near[i])
+                found = shard.cheapest_near_stations(
+                    pts[rows], radius_km, k=k, detour_cost_per_km=detour_cost_per_km
+                )
+                for row, stations in zip(rows.tolist(), found):
+                    merged = merged or bool(results[row])
+                    results[row].extend(stations)
+        if merged:
+            results = [sorted(stations, key=lambda s: s["score"])[:k] for stations in results]
+        return results
+
+    def memory_bytes(self) -> int:
+        with self._shard_lock:
+            shards = list(self._resident.values())
+        return sum(shard.memory_bytes() for shard in shards)
+
+    def tile_stats(self) -> dict:
+        """Tile cache totals over the resident shards (an evicted shard takes its tiles and counts with it)."""
+        with self._shard_lock:
+            shards = list(self._resident.values())
+        stats = [shard.tile_stats() for shard in shards]
+        return {key: sum(st[key] for st in stats) for key in ("tiles", "hits", "misses")}
+
+    def shard_status(self) -> dict:
+        """Resident shards (least recently used first), memory against the budget, load/eviction counts."""
+        with self._shard_lock:
+            resident = list(self._resident.items())
+        return {
+            "total": len(self._shard_names),
+            "resident": [name for name, _ in resident],
+            "resident_stations": sum(shard.station_count for _, shard in resident),
+            "memory_bytes": sum(shard.memory_bytes() for _, shard in resident),
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "loads": self.shard_loads,
+            "evictions": self.shard_evictions,
+        }
+
+
+class IndexNotReady(Exception):
+    """The station index is still being built and the request should not wait for it."""
+
+
+_fuel_station_index = None  # FuelStationKDTree or ShardedFuelStationIndex (FUEL_INDEX_MODE)
+# held for the whole build, so concurrent callers wait on one build instead of starting their own
+_index_lock = threading.Lock()
+_index_state = "cold"  # cold -> building -> ready | empty (no stations with coordinates) | failed
+_index_error: Optional[str] = None
+
+
+def _new_index():
+    """Empty index of the configured FUEL_INDEX_MODE: "monolithic" (one tree) or "sharded" (per state, lazy)."""
+    if getattr(settings, "FUEL_INDEX_MODE", "monolithic") == "sharded":
+        budget_mb = getattr(settings, "FUEL_INDEX_MEMORY_BUDGET_MB", 256)
+        return ShardedFuelStationIndex(int(budget_mb * 2 ** 20))
+    return FuelStationKDTree()
+
+
+def _build_index():
+    """Build a fresh global index and record the outcome. Caller holds _index_lock."""
+    global _fuel_station_index, _index_state, _index_error
+    _index_state = "building"
+    index = _new_index()
+    try:
+        index.build()
+    except Exception as e:
+        _index_state = "failed"
+        _index_error = f"{type(e).__name__}: {e}"
+        raise
+    _fuel_station_index = index
+    # an empty station table is not ready: the next use or /api/ready/ probe builds again
+    _index_state = "ready" if index.is_ready() else "empty"
+    _index_error = None
+    return index
+
+
+def ensure_fuel_station_index_built(cold_policy: Optional[str] = None):
+    """
+    Return the global station index, building it from DB if not yet ready.
+    In sharded mode "built" means the shard manifest is loaded; shards load on first use.
+    An index over an empty station table is returned (is_ready() False) but rebuilt on the next call.
+
+    If the index is not ready, either build it or wait for the running build (cold_policy, default
+    FUEL_INDEX_COLD_POLICY = "wait", at most FUEL_INDEX_WAIT_SECONDS), or start a background build
+    and raise IndexNotReady at once ("reject").
+    """
+    if _index_state == "ready":
+        return _fuel_station_index
+    if (cold_policy or getattr(settings, "FUEL_INDEX_COLD_POLICY", "wait")) == "reject":
+        _start_build_thread()
+        raise IndexNotReady("Fuel station index is warming up")
+
+    if not _index_lock.acquire(timeout=getattr(settings, "FUEL_INDEX_WAIT_SECONDS", 30)):
+        raise IndexNotReady("Timed out waiting for the fuel station index")
+    try:
+        if _index_state == "ready":
+            return _fuel_station_index
+        return _build_index()
+    finally:
+        _index_lock.release()
+
+
+def _warm_index() -> None:
+    """Warmup thread: build, then release the lock taken by start_index_warmup."""
+    try:
+        _build_index()
+        logger.info(
+            "Fuel station index %s: %d stations in %.2fs",
+            _index_state,
+            _fuel_station_index.station_count,
+            _fuel_station_index.build_seconds,
+        )
+    except Exception:
+        logger.exception("Fuel station index warmup failed")
+    finally:
+        _index_lock.release()
+        connection.close()
+
+
+def start_index_warmup() -> bool:
+    """
+    Build the index in a background thread; server entry points (wsgi/asgi) call this so
+    management commands never pay for it. Returns False if the index is ready, already building,
+    or not used for corridors (FUEL_CORRIDOR_BACKEND = "database").
+    """
+    if getattr(settings, "FUEL_CORRIDOR_BACKEND", "kdtree") == "database":
+        return False
+    return _start_build_thread()
+
+
+def preload_index() -> None:
+    """
+    Build the index in this process before serving (FUEL_INDEX_PRELOAD, for the gunicorn --preload
+    master), so forked workers inherit it ready instead of each building their own.
+    """
+    if getattr(settings, "FUEL_CORRIDOR_BACKEND", "kdtree") == "database":
+        return
+    ensure_fuel_station_index_built(cold_policy="wait")
+    connection.close()  # forked workers must not share the master's database connection
+
+
+def _start_build_thread() -> bool:
+    """Start a background build unless the index is ready or a build is running. Returns whether it started."""
+    global _index_state
+    if _index_state == "ready" or not _index_lock.acquire(blocking=False):
+        return False
+    _index_state = "building"
+    threading.Thread(target=_warm_index, name="fuel-index-warmup", daemon=True).start()
+    return True
 
-_fuel_station_index: Optional[FuelStationKDTree] = None
 
-def ensure_fuel_station_index_built() -> FuelStationKDTree:
-    """Return the global station index, building it from DB if not yet ready."""
-    global _fuel_station_index
-    if _fuel_station_index is None:
-        _fuel_station_index = FuelStationKDTree()
-    if not _fuel_station_index.is_ready():
-        _fuel_station_index.build()
-    return _fuel_station_index
+def _reset_after_fork() -> None:
+    """A forked child (e.g. gunicorn --preload) does not inherit the warmup thread: start its own."""
+    global _index_lock, _index_state
+    _index_lock = threading.Lock()
+    if isinstance(_fuel_station_index, ShardedFuelStationIndex):
+        _fuel_station_index._reset_locks()
+    if _index_state == "building":
+        _index_state = "cold"
+        start_index_warmup()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def fuel_index_status() -> dict:
+    """Readiness report for the station index in this process, with its memory use (and shards, if sharded)."""
+    index = _fuel_station_index
+    return {
+        "state": _index_state,
+        "station_count": index.station_count if index else 0,
+        "build_seconds": index.build_seconds if index else None,
+        "data_version": index.data_version if index else None,
+        "error": _index_error,
+        "corridor_backend": getattr(settings, "FUEL_CORRIDOR_BACKEND", "kdtree"),
+        "index_mode": getattr(settings, "FUEL_INDEX_MODE", "monolithic"),
+        "memory_bytes": index.memory_bytes() if index else 0,
+        "tile_cache": index.tile_stats() if index else None,
+        "shards": index.shard_status() if isinstance(index, ShardedFuelStationIndex) else None,
+    }
+
+
+def query_corridor_database(
+    points,
+    radius_deg: float,
+    chunk_points: int = CORRIDOR_CHUNK_POINTS,
+) -> List[FuelStation]:
+    """
+    Stations within radius_deg of any of points, without the in-memory index.
+    One query ORs a bounding box per chunk of consecutive points (served by the latitude/longitude
+    index); the exact distance filter then runs in NumPy.
+    """
+    pts = np.asarray(points, dtype=float).reshape(-1, 2)
+    if not len(pts):
+        return []
+
+    boxes = Q()
+    for start in range(0, len(pts), chunk_points):
+        chunk = pts[start:start + chunk_points]
+        lat_min, lon_min = chunk.min(axis=0) - radius_deg
+        lat_max, lon_max = chunk.max(axis=0) + radius_deg
+        boxes |= Q(latitude__range=(float(lat_min), float(lat_max)), longitude__range=(float(lon_min), float(lon_max)))
+    stations = list(FuelStation.objects.filter(boxes))
+    if not stations:
+        return []
+
+    coords = np.asarray([(s.latitude, s.longitude) for s in stations], dtype=float)
+    nearest_sq = np.full(len(stations), np.inf)
+    for start in range(0, len(pts), chunk_points):
+        diff = coords[:, None, :] - pts[None, start:start + chunk_points, :]
+        nearest_sq = np.minimum(nearest_sq, (diff * diff).sum(axis=2).min(axis=1))
+    return [s for s, d_sq in zip(stations, nearest_sq) if d_sq <= radius_deg * radius_deg]
 
 
 def get_stations_near_route(
-    polyline_points: List[Tuple[float, float]],
+    polyline_points,
     radius_deg: float = 0.3,
     max_queries: int = 200,
 ) -> List[FuelStation]:
     """
-    Return stations within radius_deg of the route.
+    Return stations within radius_deg of the route, from the in-memory KD-tree or, with
+    FUEL_CORRIDOR_BACKEND = "database", from bounding-box queries (no per-process index).
 
-    polyline_points: list of (lat, lon) along the route (from routing API).
+    polyline_points: (n, 2) array or list of (lat, lon) along the route (from routing API).
     radius_deg: search radius in degrees (~0.25–0.3 ≈ 25–35 km).
-    max_queries: cap on how many points we sample along the route (avoids too many tree queries).
+    max_queries: cap on how many points we sample along the route (bounds the tiles and distance checks).
     """
-    if not polyline_points:
+    if len(polyline_points) == 0:
         return []
-
-    index = ensure_fuel_station_index_built()
     step = max(1, len(polyline_points) // max_queries)
+    if getattr(settings, "FUEL_CORRIDOR_BACKEND", "kdtree") == "database":
+        return query_corridor_database(polyline_points[::step], radius_deg)
 
-    seen_ids: set = set()
-    out: List[FuelStation] = []
+    index = ensure_fuel_station_index_built()
+    if not index.is_ready():
+        # no stations with coordinates loaded
+        return []
+    ids = index.query_corridor(polyline_points[::step], radius_deg)
+    if not ids:
+        return []
+    return list(FuelStation.objects.filter(id__in=ids))
 
-    for i in range(0, len(polyline_points), step):
-        lat, lon = polyline_points[i]
-        for station in index.query_within_radius(lat, lon, radius_deg):
-            if station.id not in seen_ids:
-                seen_ids.add(station.id)
-                out.append(station)
 
-    return out
\ No newline at end of file
+def get_cheapest_stations_near_points(
+    points,
+    radius_km: float,
+    k: int = 5,
+    detour_cost_per_km: float = 0.0,
+) -> List[List[dict]]:
+    """
+    For each (lat, lon) in points, up to k stations within radius_km, cheapest first
+    (score = price + detour_cost_per_km * distance_km). Served from the index: no DB queries,
+    except to load a shard the first time it is needed in sharded mode.
+    """
+    index = ensure_fuel_station_index_built()
+    if not index.is_ready():
+        return [[] for _ in points]
+    return index.cheapest_near_stations(points, radius_km, k=k, detour_cost_per_km=detour_cost_per_km)
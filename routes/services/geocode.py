@@ -1,23 +1,23 @@
 """Shared geocoding: address → (lat, lon)."""
-from typing import Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Optional
 
 import requests
 
 from django.conf import settings
 
-GEOCODE_URL = "https://api.openrouteservice.org/geocode/search"
+GEOCODE_PATH = "/geocode/search"
 
 
 def geocode_address(text: str, country: str = "USA") -> Tuple[Optional[float], Optional[float]]:
     """Return (lat, lon) or (None, None)."""
     api_key = getattr(settings, "ORS_API_KEY", None)
-    print(api_key, "line14")
     if not api_key:
         return None, None
 
     params = {"api_key": api_key, "text": text, "boundary.country": country}
     try:
-        resp = requests.get(GEOCODE_URL, params=params, timeout=10)
+        resp = requests.get(settings.ORS_BASE_URL + GEOCODE_PATH, params=params, timeout=10)
         resp.raise_for_status()
         data = resp.json()
     except (requests.RequestException, ValueError):
@@ -44,12 +44,33 @@ def geocode_origin_destination(
     Returns ((lat_origin, lon_origin), (lat_dest, lon_dest)).
     Raises ValueError if either address fails.
     """
-    lat_orig, lon_orig = geocode_address(origin, country=country)
-    if lat_orig is None or lon_orig is None:
-        raise ValueError(f"Could not geocode origin: {origin!r}")
+    origin_point, destination_point = geocode_waypoints([origin, destination], country=country)
+    return origin_point, destination_point
 
-    lat_dest, lon_dest = geocode_address(destination, country=country)
-    if lat_dest is None or lon_dest is None:
-        raise ValueError(f"Could not geocode destination: {destination!r}")
 
-    return (lat_orig, lon_orig), (lat_dest, lon_dest)
\ No newline at end of file
+def geocode_waypoints(
+    waypoints: List[str],
+    country: str = "USA",
+    max_workers: int = 8,
+) -> List[Tuple[float, float]]:
+    """
+    Geocode an ordered list of stops concurrently. Returns [(lat, lon), ...] in the same order.
+    Raises ValueError naming the first stop that fails (origin, waypoint N, or destination).
+    """
+    if not waypoints:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(waypoints))) as pool:
+        results = list(pool.map(lambda text: geocode_address(text, country=country), waypoints))
+
+    points = []
+    for i, (text, (lat, lon)) in enumerate(zip(waypoints, results)):
+        if lat is None or lon is None:
+            if i == 0:
+                label = "origin"
+            elif i == len(waypoints) - 1:
+                label = "destination"
+            else:
+                label = f"waypoint {i}"
+            raise ValueError(f"Could not geocode {label}: {text!r}")
+        points.append((lat, lon))
+    return points
\ No newline at end of file
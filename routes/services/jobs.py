@@ -0,0 +1,124 @@
+# routes/services/jobs.py
+"""Database-backed plan job queue: submit, claim, run and report."""
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from django.db.models import Count
+from django.utils import timezone
+
+from routes.models import PlanJob
+from routes.services.fuel import IndexNotReady
+from routes.services.planner import RoutingError, build_plan
+
+# finished jobs the timing percentiles are computed over
+STATS_WINDOW_JOBS = 500
+
+
+def submit_jobs(trips: List[List[str]]) -> List[PlanJob]:
+    """Queue one job per trip; a trip is its stops in order, origin and destination included."""
+    return PlanJob.objects.bulk_create([
+        PlanJob(origin=stops[0], destination=stops[-1], waypoints=list(stops) if len(stops) > 2 else [])
+        for stops in trips
+    ])
+
+
+def claim_next_job(worker: str) -> Optional[PlanJob]:
+    """
+    Oldest queued job, marked running for `worker`; None if the queue is empty.
+    The status-conditional UPDATE makes the claim atomic across worker processes on any backend.
+    """
+    while True:
+        job_ids = list(
+            PlanJob.objects.filter(status=PlanJob.QUEUED).order_by("created_at", "id").values_list("id", flat=True)[:10]
+        )
+        if not job_ids:
+            return None
+        for job_id in job_ids:
+            claimed = PlanJob.objects.filter(id=job_id, status=PlanJob.QUEUED).update(
+                status=PlanJob.RUNNING, started_at=timezone.now(), worker=worker
+            )
+            if claimed:
+                return PlanJob.objects.get(id=job_id)
+
+
+def run_job(job: PlanJob) -> PlanJob:
+    """Execute a claimed job and store its result or error."""
+    try:
+        job.result = build_plan(job.stops, remember=False)
+        job.status = PlanJob.DONE
+    except (ValueError, RoutingError, IndexNotReady) as e:
+        job.status = PlanJob.FAILED
+        job.error = str(e)
+    except Exception as e:
+        job.status = PlanJob.FAILED
+        job.error = f"{type(e).__name__}: {e}"
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "result", "error", "finished_at"])
+    return job
+
+
+def requeue_stale_jobs(older_than_seconds: float) -> int:
+    """Put back jobs left running longer than older_than_seconds (e.g. their worker died)."""
+    cutoff = timezone.now() - timedelta(seconds=older_than_seconds)
+    return PlanJob.objects.filter(status=PlanJob.RUNNING, started_at__lt=cutoff).update(
+        status=PlanJob.QUEUED, started_at=None, worker=""
+    )
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"avg": None, "p50": None, "p95": None, "max": None}
+    arr = np.asarray(values, dtype=float)
+    p50, p95 = np.percentile(arr, [50, 95])
+    return {"avg": float(arr.mean()), "p50": float(p50), "p95": float(p95), "max": float(arr.max())}
+
+
+def queue_stats() -> dict:
+    """Queue depth by status, timing percentiles over recent finished jobs, and completion throughput."""
+    counts = {status: 0 for status, _ in PlanJob.STATUS_CHOICES}
+    for row in PlanJob.objects.values("status").annotate(n=Count("id")):
+        counts[row["status"]] = row["n"]
+
+    recent = list(
+        PlanJob.objects.filter(finished_at__isnull=False)
+        .order_by("-finished_at")
+        .values_list("created_at", "started_at", "finished_at")[:STATS_WINDOW_JOBS]
+    )
+    queue_s = [(started - created).total_seconds() for created, started, _ in recent]
+    run_s = [(finished - started).total_seconds() for _, started, finished in recent]
+
+    now = timezone.now()
+    throughput = {}
+    for label, seconds in (("last_1m", 60), ("last_5m", 300)):
+        done = PlanJob.objects.filter(finished_at__gte=now - timedelta(seconds=seconds)).count()
+        throughput[label] = done / seconds
+
+    return {
+        "depth": counts[PlanJob.QUEUED],
+        "counts": counts,
+        "queue_seconds": _percentiles(queue_s),
+        "run_seconds": _percentiles(run_s),
+        "throughput_jobs_per_s": throughput,
+        "timings_window": len(recent),
+    }
+
+
+def job_payload(job: PlanJob) -> dict:
+    """Status response for one job; the plan is included once done."""
+    payload = {
+        "job_id": job.id,
+        "status": job.status,
+        "origin": job.origin,
+        "destination": job.destination,
+        "waypoints": job.stops,
+        "created_at": job.created_at.isoformat(),
+        "queue_seconds": job.queue_seconds,
+        "run_seconds": job.run_seconds,
+    }
+    if job.status == PlanJob.DONE:
+        payload["result"] = job.result
+    elif job.status == PlanJob.FAILED:
+        payload["error"] = job.error
+    return payload
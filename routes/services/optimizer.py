@@ -1,47 +1,69 @@
 # routes/services/optimizer.py
 """Pick best fuel stop(s) along the route by segment (one per range window, cheapest in segment)."""
 import math
-from typing import List, Tuple
+from typing import List, NamedTuple
+
+import numpy as np
+from scipy.spatial import KDTree
 
 from routes.models import FuelStation
 from routes.services.fuel import (
+    EARTH_RADIUS_KM,
     cumulative_distances_km,
     get_stations_near_route,
-    haversine_km,
 )
 
 VEHICLE_RANGE_KM = 500 * 1.60934
+# a station can be pruned only by a cheaper, closer-to-route station in its own segment within this many km
+DOMINANCE_WINDOW_KM = 5.0
 
 
-def _distance_along_route(
-    station_lat: float,
-    station_lon: float,
-    polyline_points: List[Tuple[float, float]],
-    cumulative_km: List[float],
-) -> float:
-    """Return distance in km from route start to the point on route nearest to (station_lat, station_lon)."""
-    best_km = 0.0
-    best_d = float("inf")
-    for i, (lat, lon) in enumerate(polyline_points):
-        d = haversine_km(station_lat, station_lon, lat, lon)
-        if d < best_d:
-            best_d = d
-            best_km = cumulative_km[i]
-    return best_km
+class RangeMinIndex:
+    """Sparse table over a value array: index of the minimum in any [lo, hi) range in O(1)."""
 
+    def __init__(self, values) -> None:
+        self._values = np.asarray(values, dtype=float)
+        n = len(self._values)
+        self._table: List[np.ndarray] = [np.arange(n)]
+        width = 2
+        while width <= n:
+            prev = self._table[-1]
+            left = prev[: n - width + 1]
+            right = prev[width // 2: width // 2 + n - width + 1]
+            # ties keep the left (earlier) index
+            self._table.append(np.where(self._values[left] <= self._values[right], left, right))
+            width *= 2
 
-def get_optimal_fuel_stops(
-    polyline_points: List[tuple],
-    total_km: float,
-    range_km: float = VEHICLE_RANGE_KM,
-    max_stops: int = 10,
+    def argmin(self, lo: int, hi: int) -> int:
+        """Index of the smallest value in values[lo:hi]; -1 if the range is empty."""
+        if hi <= lo:
+            return -1
+        level = (hi - lo).bit_length() - 1
+        a = int(self._table[level][lo])
+        b = int(self._table[level][hi - (1 << level)])
+        return a if self._values[a] <= self._values[b] else b
+
+
+class StationPosition(NamedTuple):
+    station: FuelStation
+    km: float  # distance from route start to the route vertex nearest the station
+    detour_km: float  # distance from that vertex to the station
+
+
+def _unit_vectors(points: np.ndarray) -> np.ndarray:
+    """(lat, lon) degrees -> 3D unit vectors; chord length between them orders like great-circle distance."""
+    lat = np.radians(points[:, 0])
+    lon = np.radians(points[:, 1])
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def get_station_positions(
+    polyline_points,
     radius_deg: float = 0.3,
-) -> List[FuelStation]:
-    """
-    One stop per range_km segment along the route; in each segment pick the cheapest station.
-    polyline_points: list of (lat, lon) from routing.get_route().
-    """
-    if not polyline_points:
+) -> List[StationPosition]:
+    """Corridor stations near the route with their distance along it and lateral detour."""
+    polyline_points = np.asarray(polyline_points, dtype=float).reshape(-1, 2)
+    if not len(polyline_points):
         return []
 
     candidates = get_stations_near_route(polyline_points, radius_deg=radius_deg)
@@ -49,32 +71,165 @@ def get_optimal_fuel_stops(
         return []
 
     cumulative_km = cumulative_distances_km(polyline_points)
-    station_to_km = [
-        (s, _distance_along_route(s.latitude, s.longitude, polyline_points, cumulative_km))
-        for s in candidates
+    station_coords = np.asarray([(s.latitude, s.longitude) for s in candidates], dtype=float)
+    chord, nearest = KDTree(_unit_vectors(polyline_points)).query(_unit_vectors(station_coords))
+    detour_km = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2, 0.0, 1.0))
+    return [
+        StationPosition(s, float(cumulative_km[i]), float(d))
+        for s, i, d in zip(candidates, nearest, detour_km)
     ]
 
-    num_segments = min(max_stops, max(1, math.ceil(total_km / range_km)))
-    segment_size = total_km / num_segments
-    result: List[FuelStation] = []
-    used_ids = set()
-
-    for seg in range(num_segments):
-        seg_start = seg * segment_size
-        seg_end = (seg + 1) * segment_size
-        seg_mid = (seg_start + seg_end) / 2
-        in_segment = [
-            (s, km) for s, km in station_to_km
-            if seg_start <= km < seg_end and s.id not in used_ids
-        ]
-        if not in_segment:
-            unused = [(s, km) for s, km in station_to_km if s.id not in used_ids]
-            if not unused:
+
+def prune_dominated(
+    positions: List[StationPosition],
+    total_km: float,
+    range_km: float = VEHICLE_RANGE_KM,
+    max_stops: int = 10,
+    window_km: float = DOMINANCE_WINDOW_KM,
+) -> List[StationPosition]:
+    """
+    Drop stations that select_fuel_stops (same total_km, range_km, max_stops) can never pick: those with
+    a station in the same segment, within window_km along the route, that is no farther off the route
+    and either cheaper or as cheap and earlier (select_fuel_stops breaks price ties by km).
+    If any segment is empty, selection falls back to stations in other segments, so nothing is pruned.
+    Returns the remaining set sorted by km.
+    """
+    ordered = sorted(positions, key=lambda p: p.km)
+    if len(ordered) < 2:
+        return ordered
+
+    km = np.asarray([p.km for p in ordered])
+    edges = segment_edges(0.0, total_km, range_km=range_km, max_stops=max_stops)
+    # segment s holds edges[s] <= km < edges[s + 1], as in pick_segment_stops
+    segment = np.searchsorted(edges, km, side="right") - 1
+    in_route = (segment >= 0) & (segment < len(edges) - 1)
+    if np.any(np.bincount(segment[in_route], minlength=len(edges) - 1) == 0):
+        return ordered
+
+    prices = np.asarray([float(p.station.retail_price) for p in ordered])
+    detours = np.asarray([p.detour_km for p in ordered])
+    lo = np.searchsorted(km, km - window_km, side="left")
+    hi = np.searchsorted(km, km + window_km, side="right")
+
+    kept: List[StationPosition] = []
+    for i, position in enumerate(ordered):
+        if not in_route[i]:
+            kept.append(position)
+            continue
+        window = slice(lo[i], hi[i])
+        earlier = np.arange(lo[i], hi[i]) < i
+        beats = (prices[window] < prices[i]) | ((prices[window] == prices[i]) & earlier)
+        dominated = (segment[window] == segment[i]) & (detours[window] <= detours[i]) & beats
+        if not np.any(dominated):
+            kept.append(position)
+    return kept
+
+
+def _nearest_unused(km: np.ndarray, prices: np.ndarray, used: np.ndarray, target_km: float) -> int:
+    """Index of the unused station closest to target_km (cheapest on ties); -1 if all are used."""
+    right = int(np.searchsorted(km, target_km))
+    left = right - 1
+    while left >= 0 and used[left]:
+        left -= 1
+    while right < len(km) and used[right]:
+        right += 1
+    options = [i for i in (left, right) if 0 <= i < len(km)]
+    if not options:
+        return -1
+    best_km = km[min(options, key=lambda i: abs(km[i] - target_km))]
+    # several stations can share that position
+    lo = int(np.searchsorted(km, best_km, side="left"))
+    hi = int(np.searchsorted(km, best_km, side="right"))
+    return _cheapest_unused(prices, used, lo, hi)
+
+
+def _cheapest_unused(prices: np.ndarray, used: np.ndarray, lo: int, hi: int) -> int:
+    """Index of the cheapest unused station in [lo, hi) (earliest on ties); -1 if none."""
+    free = np.flatnonzero(~used[lo:hi])
+    if not free.size:
+        return -1
+    return lo + int(free[np.argmin(prices[lo:hi][free])])
+
+
+def segment_edges(
+    start_km: float,
+    end_km: float,
+    range_km: float = VEHICLE_RANGE_KM,
+    max_stops: int = 10,
+) -> np.ndarray:
+    """Boundaries of the equal segments between start_km and end_km: ceil(length / range_km) of them, at most max_stops."""
+    length = end_km - start_km
+    num_segments = min(max_stops, max(1, math.ceil(length / range_km)))
+    return start_km + np.arange(num_segments + 1) * (length / num_segments)
+
+
+def pick_segment_stops(
+    km: np.ndarray,
+    prices: np.ndarray,
+    cheapest: RangeMinIndex,
+    edges: np.ndarray,
+    used: np.ndarray,
+) -> np.ndarray:
+    """
+    Mark one stop per [edges[s], edges[s + 1]) segment in `used` and return it: the cheapest station
+    in the segment (earliest on ties), or the unused station nearest its midpoint if the segment is empty.
+    km must be sorted; stations already marked used are never picked. cheapest is RangeMinIndex(prices).
+    """
+    for seg_start, seg_end in zip(edges[:-1], edges[1:]):
+        lo = int(np.searchsorted(km, seg_start, side="left"))
+        hi = int(np.searchsorted(km, seg_end, side="left"))
+        best = cheapest.argmin(lo, hi)
+        if best >= 0 and used[best]:
+            best = _cheapest_unused(prices, used, lo, hi)
+        if best < 0:
+            best = _nearest_unused(km, prices, used, (seg_start + seg_end) / 2)
+            if best < 0:
                 continue
-            best = min(unused, key=lambda x: (abs(x[1] - seg_mid), x[0].retail_price))
-        else:
-            best = min(in_segment, key=lambda x: (x[0].retail_price, x[1]))
-        result.append(best[0])
-        used_ids.add(best[0].id)
+        used[best] = True
+    return used
+
+
+def select_fuel_stops(
+    positions: List[StationPosition],
+    total_km: float,
+    range_km: float = VEHICLE_RANGE_KM,
+    max_stops: int = 10,
+) -> List[FuelStation]:
+    """
+    One stop per range_km segment; in each segment pick the cheapest station (earliest on ties).
+    positions must be sorted by km (as returned by prune_dominated); segments are located by binary search.
+    An empty segment takes the unused station nearest its midpoint instead.
+    """
+    if not positions:
+        return []
+
+    km = np.asarray([p.km for p in positions])
+    prices = np.asarray([float(p.station.retail_price) for p in positions])
+    used = pick_segment_stops(
+        km,
+        prices,
+        RangeMinIndex(prices),
+        segment_edges(0.0, total_km, range_km=range_km, max_stops=max_stops),
+        np.zeros(len(positions), dtype=bool),
+    )
+    return [positions[i].station for i in np.flatnonzero(used)]
 
-    return sorted(result, key=lambda s: _distance_along_route(s.latitude, s.longitude, polyline_points, cumulative_km))
\ No newline at end of file
+
+def get_optimal_fuel_stops(
+    polyline_points,
+    total_km: float,
+    range_km: float = VEHICLE_RANGE_KM,
+    max_stops: int = 10,
+    radius_deg: float = 0.3,
+) -> List[FuelStation]:
+    """
+    One stop per range_km segment along the route; in each segment pick the cheapest station.
+    polyline_points: (n, 2) array of (lat, lon) from routing.get_route().
+    """
+    positions = prune_dominated(
+        get_station_positions(polyline_points, radius_deg=radius_deg),
+        total_km=total_km,
+        range_km=range_km,
+        max_stops=max_stops,
+    )
+    return select_fuel_stops(positions, total_km=total_km, range_km=range_km, max_stops=max_stops)
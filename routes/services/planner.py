@@ -0,0 +1,72 @@
+# routes/services/planner.py
+"""Full route plan: geocode + route, corridor stations, fuel stops, stored RoutePlan. Shared by the API and job workers."""
+import math
+from typing import List
+
+from routes.models import RoutePlan
+from routes.services.optimizer import get_station_positions, prune_dominated, select_fuel_stops, VEHICLE_RANGE_KM
+from routes.services.replan import ReplanContext, remember_plan
+from routes.services.routing import get_route_via
+
+
+class RoutingError(Exception):
+    """The routing provider failed or returned something unusable."""
+
+
+def build_plan(waypoints: List[str], remember: bool = True) -> dict:
+    """
+    Plan a trip through `waypoints` (origin, any intermediate stops, destination) and store it
+    for replanning. With remember=False (job workers, which never serve replans) the plan is
+    only stored in the DB, not kept in this process's replan cache. Returns the plan_route response body. Fuel stops are chosen over the whole
+    trip, so fuel left at an intermediate stop carries into the next leg.
+    Raises ValueError for bad input (e.g. geocode failure), RoutingError if routing fails,
+    and IndexNotReady if the station index is still warming up.
+    """
+    try:
+        polyline, total_km, legs = get_route_via(waypoints)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise RoutingError(f"Routing failed: {e}") from e
+
+    max_stops = max(1, math.ceil(total_km / VEHICLE_RANGE_KM))
+    positions = get_station_positions(polyline)
+    pruned = prune_dominated(positions, total_km=total_km, range_km=VEHICLE_RANGE_KM, max_stops=max_stops)
+    stops = select_fuel_stops(pruned, total_km=total_km, range_km=VEHICLE_RANGE_KM, max_stops=max_stops)
+    fuel_stops = [
+        {
+            "id": s.id,
+            "name": s.truck_stop_name,
+            "price": float(s.retail_price),
+            "lat": s.latitude,
+            "lon": s.longitude,
+        }
+        for s in stops
+    ]
+
+    # replanning keeps every corridor station: a pruned one can still be the best pick near the truck
+    station_to_km = [(p.station, p.km) for p in positions]
+    plan = RoutePlan.objects.create(
+        origin=waypoints[0],
+        destination=waypoints[-1],
+        waypoints=list(waypoints),
+        polyline=polyline.tolist(),
+        total_km=total_km,
+        legs=legs,
+        candidates=[[s.id, km] for s, km in station_to_km],
+    )
+    if remember:
+        remember_plan(ReplanContext(plan.id, polyline, total_km, station_to_km))
+
+    return {
+        "plan_id": plan.id,
+        "waypoints": list(waypoints),
+        "polyline": polyline.tolist(),
+        "total_km": total_km,
+        "legs": legs,
+        "fuel_stops": fuel_stops,
+        "debug": {
+            "candidates": len(positions),
+            "pruned_candidates": len(pruned),
+        },
+    }
@@ -0,0 +1,151 @@
+# routes/services/replan.py
+"""Mid-trip replanning on a stored RoutePlan: no geocoding, routing or corridor search."""
+import math
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+
+import numpy as np
+
+from django.conf import settings
+
+from routes.models import FuelStation, RoutePlan
+from routes.services.fuel import cumulative_distances_km, snap_to_route
+from routes.services.optimizer import VEHICLE_RANGE_KM, RangeMinIndex, pick_segment_stops, segment_edges
+
+
+class ReplanContext:
+    """
+    Along-route structures for one plan, built once and reused by every replan.
+
+    All km values are scaled so the polyline length matches the routed total_km
+    (the straight-line sum of the polyline slightly under-counts road distance).
+    """
+
+    def __init__(
+        self,
+        plan_id: int,
+        polyline_points,
+        total_km: float,
+        station_to_km: List[Tuple[FuelStation, float]],
+    ) -> None:
+        self.plan_id = plan_id
+        self.total_km = total_km
+        self.coords = np.asarray(polyline_points, dtype=float)
+        cumulative_km = np.asarray(cumulative_distances_km(polyline_points), dtype=float)
+        route_km = cumulative_km[-1] if len(cumulative_km) else 0.0
+        self.scale = total_km / route_km if route_km > 0 else 1.0
+        self.cumulative_km = cumulative_km * self.scale
+
+        ordered = sorted(station_to_km, key=lambda x: x[1])
+        self.stations: List[FuelStation] = [s for s, _ in ordered]
+        # station km as the plan measured them (polyline km, unscaled): fuel stops are chosen on these
+        self.plan_km = np.asarray([km for _, km in ordered], dtype=float)
+        self.station_km = self.plan_km * self.scale
+        self.prices = np.asarray([float(s.retail_price) for s in self.stations], dtype=float)
+        self.cheapest = RangeMinIndex(self.prices)
+
+    @classmethod
+    def from_plan(cls, plan: RoutePlan) -> "ReplanContext":
+        """Rebuild from the stored plan: a single query for its corridor stations."""
+        station_ids = [int(station_id) for station_id, _ in plan.candidates]
+        stations = FuelStation.objects.in_bulk(station_ids)
+        station_to_km = [
+            (stations[int(station_id)], km)
+            for station_id, km in plan.candidates
+            if int(station_id) in stations
+        ]
+        return cls(plan.id, plan.polyline, plan.total_km, station_to_km)
+
+
+_contexts: "OrderedDict[int, ReplanContext]" = OrderedDict()
+_contexts_lock = threading.Lock()
+
+
+def _cache_size() -> int:
+    return getattr(settings, "REPLAN_CACHE_SIZE", 128)
+
+
+def remember_plan(context: ReplanContext) -> None:
+    """Keep a freshly computed plan's context so the first replan skips the DB."""
+    with _contexts_lock:
+        _contexts[context.plan_id] = context
+        _contexts.move_to_end(context.plan_id)
+        while len(_contexts) > _cache_size():
+            _contexts.popitem(last=False)
+
+
+def get_replan_context(plan_id: int) -> ReplanContext:
+    """Return the cached context for plan_id, loading it from the DB on a miss (RoutePlan.DoesNotExist if unknown)."""
+    with _contexts_lock:
+        context = _contexts.get(plan_id)
+        if context is not None:
+            _contexts.move_to_end(plan_id)
+            return context
+
+    context = ReplanContext.from_plan(RoutePlan.objects.get(id=plan_id))
+    remember_plan(context)
+    return context
+
+
+def _segment_stops(context: ReplanContext, ahead: int, start_km: float, fuel_km: float, range_km: float) -> List[int]:
+    """
+    select_fuel_stops' policy from plan km start_km to the destination, over stations[ahead:]:
+    ceil(rest / range_km) equal segments, cheapest station in each. None if fuel_km covers the rest.
+    Works in the plan's own units (unscaled station km against total_km), as select_fuel_stops did.
+    """
+    if context.total_km - start_km * context.scale <= fuel_km:
+        return []
+    # stations behind count as used, so no segment (or empty-segment fallback) picks them
+    used = np.zeros(len(context.stations), dtype=bool)
+    used[:ahead] = True
+    edges = segment_edges(start_km, context.total_km, range_km=range_km, max_stops=math.inf)
+    pick_segment_stops(context.plan_km, context.prices, context.cheapest, edges, used)
+    return [ahead + int(i) for i in np.flatnonzero(used[ahead:])]
+
+
+def replan_fuel_stops(
+    context: ReplanContext,
+    lat: float,
+    lon: float,
+    fuel_km: float,
+    range_km: float = VEHICLE_RANGE_KM,
+) -> dict:
+    """
+    Snap (lat, lon) onto the route and plan the remaining stops with the plan's own policy
+    (select_fuel_stops): the rest of the route is split into ceil(remaining / range_km) equal
+    segments and the cheapest station ahead in each is picked, so a replan at the origin on a
+    full tank reproduces the plan. If fuel_km does not reach the end of the first segment, the
+    first stop is the cheapest station within fuel_km instead, and the policy restarts from there
+    on a full tank. No stops are needed if fuel_km covers the rest of the route.
+    `reachable` is false if the fuel left or a full tank does not cover a gap between stops.
+    Returns position_km, offset_km, remaining_km, reachable and the chosen stop indices into context.stations.
+    """
+    position_km, offset_km = snap_to_route(lat, lon, context.coords, context.cumulative_km)
+    remaining_km = max(0.0, context.total_km - position_km)
+
+    plan_position = position_km / context.scale
+    ahead = int(np.searchsorted(context.plan_km, plan_position, side="left"))
+    first = -1
+    edges = segment_edges(plan_position, context.total_km, range_km=range_km, max_stops=math.inf)
+    # like select_fuel_stops, treat plan km as road km: a full tank always reaches the end of a segment
+    reach = plan_position + fuel_km
+    if fuel_km < remaining_km and reach < edges[1]:
+        hi = int(np.searchsorted(context.plan_km, reach, side="right"))
+        first = context.cheapest.argmin(ahead, hi)
+    if first >= 0:
+        stop_indices = [first] + _segment_stops(context, first + 1, float(context.plan_km[first]), range_km, range_km)
+    else:
+        stop_indices = _segment_stops(context, ahead, plan_position, fuel_km, range_km)
+
+    stops_km = [position_km] + [float(context.station_km[i]) for i in stop_indices] + [context.total_km]
+    gaps = np.diff(stops_km)
+    reachable = bool(gaps[0] <= fuel_km and np.all(gaps[1:] <= range_km))
+
+    return {
+        "position_km": position_km,
+        "offset_km": offset_km,
+        "remaining_km": remaining_km,
+        "reachable": reachable,
+        "stop_indices": stop_indices,
+    }
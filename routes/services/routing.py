@@ -3,22 +3,45 @@
 # routes/services/routing.py
 """Get driving route from A to B (one Directions call, addresses accepted)."""
 from typing import List, Tuple
-import requests
-
-def _decode_polyline(encoded: str) -> List[Tuple[float, float]]:
-    """Decode ORS/Google-style encoded polyline to list of (lat, lon)."""
-    try:
-        import polyline
-        return polyline.decode(encoded)
-    except Exception as e:
-         print(e)
 
+import numpy as np
+import requests
 
 
-def parse_ors_route_response(data: dict) -> Tuple[List[Tuple[float, float]], float]:
+def _decode_polyline(encoded: str, precision: int = 5) -> np.ndarray:
+    """
+    Decode ORS/Google-style encoded polyline to an (n, 2) float64 array of (lat, lon).
+    Vectorized: no per-vertex Python objects, so 50k+ vertex routes decode in a few ms.
+    Raises ValueError on malformed input.
+    """
+    # int32 is enough: a 5-chunk value needs at most 30 bits at precision 5
+    chunks = np.frombuffer(encoded.encode("ascii"), dtype=np.uint8).astype(np.int32) - 63
+    if not chunks.size:
+        return np.empty((0, 2), dtype=np.float64)
+    if (chunks < 0).any() or (chunks > 63).any() or chunks[-1] & 0x20:
+        raise ValueError("Malformed polyline")
+
+    # each value is a run of 5-bit chunks, least significant first; the last chunk lacks the 0x20 flag
+    ends = (chunks & 0x20) == 0
+    starts = np.flatnonzero(np.concatenate(([True], ends[:-1])))
+    if starts.size % 2:
+        raise ValueError("Malformed polyline")
+    shifts = np.arange(chunks.size, dtype=np.int32)
+    shifts -= np.repeat(starts.astype(np.int32), np.diff(np.append(starts, chunks.size)))
+    shifts *= 5
+    chunks &= 0x1F
+    chunks <<= shifts
+    del shifts, ends
+    values = np.add.reduceat(chunks, starts)
+
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0, dtype=np.int64) / float(10 ** precision)
+
+
+def parse_ors_route_response(data: dict) -> Tuple[np.ndarray, float]:
     """
     Parse ORS structured response: routes[0].geometry (encoded polyline),
-    routes[0].summary.distance (meters). Returns (polyline as (lat, lon), total_km).
+    routes[0].summary.distance (meters). Returns (polyline as (n, 2) array of (lat, lon), total_km).
     """
     routes = data.get("routes") or []
     if not routes:
@@ -29,24 +52,37 @@ def parse_ors_route_response(data: dict) -> Tuple[List[Tuple[float, float]], flo
     if not enc or not isinstance(enc, str):
         raise RuntimeError("ORS: route has no geometry")
 
-    polyline_points = _decode_polyline(enc)
+    try:
+        polyline_points = _decode_polyline(enc)
+    except ValueError as e:
+        raise RuntimeError(f"ORS: malformed route geometry ({e})") from e
     summary = route.get("summary") or {}
     total_m = summary.get("distance", 0)
     return polyline_points, total_m / 1000.0
 
-ORS_DIRECTIONS_URL = "https://api.openrouteservice.org/v2/directions/driving-car"
-
 
-def get_route_ors(
-    origin_lat: float,
-    origin_lon: float,
-    dest_lat: float,
-    dest_lon: float,
-) -> Tuple[List[Tuple[float, float]], float]:
+def parse_ors_route_legs(data: dict, n_points: int) -> List[Tuple[float, int, int]]:
     """
-    Get driving route from ORS using coordinates.
-    ORS expects [lon, lat]. Returns (polyline as (lat, lon), total_km).
+    Legs of routes[0] from segments[].distance and way_points (polyline indices of each stop).
+    Returns [(distance_km, polyline_start, polyline_end), ...]; one leg for responses without them.
     """
+    route = (data.get("routes") or [{}])[0]
+    segments = route.get("segments") or []
+    way_points = route.get("way_points") or []
+    if not segments or len(way_points) != len(segments) + 1:
+        total_m = (route.get("summary") or {}).get("distance", 0)
+        return [(total_m / 1000.0, 0, max(0, n_points - 1))]
+    return [
+        (seg.get("distance", 0) / 1000.0, int(start), int(end))
+        for seg, start, end in zip(segments, way_points, way_points[1:])
+    ]
+
+
+ORS_DIRECTIONS_PATH = "/v2/directions/driving-car"
+
+
+def request_ors_directions(points: List[Tuple[float, float]]) -> dict:
+    """One ORS Directions call through every (lat, lon) in order (ORS takes [lon, lat]). Returns the JSON body."""
     from django.conf import settings
 
     api_key = getattr(settings, "ORS_API_KEY", None) or getattr(settings, "GEOAPIFY_KEY", None)
@@ -55,26 +91,70 @@ def get_route_ors(
 
     # ORS: coordinates as [lon, lat]
     body = {
-        "coordinates": [[origin_lon, origin_lat], [dest_lon, dest_lat]],
+        "coordinates": [[lon, lat] for lat, lon in points],
     }
     headers = {"Authorization": api_key}
-    resp = requests.post(ORS_DIRECTIONS_URL, json=body, headers=headers, timeout=15)
+    resp = requests.post(settings.ORS_BASE_URL + ORS_DIRECTIONS_PATH, json=body, headers=headers, timeout=15)
     resp.raise_for_status()
-    data = resp.json()
-    # print(data, "line64")
+    return resp.json()
+
+
+def get_route_ors(
+    origin_lat: float,
+    origin_lon: float,
+    dest_lat: float,
+    dest_lon: float,
+) -> Tuple[np.ndarray, float]:
+    """
+    Get driving route from ORS using coordinates.
+    ORS expects [lon, lat]. Returns (polyline as (n, 2) array of (lat, lon), total_km).
+    """
+    data = request_ors_directions([(origin_lat, origin_lon), (dest_lat, dest_lon)])
     return parse_ors_route_response(data)
 
 
+def get_route_via(waypoints: List[str]) -> Tuple[np.ndarray, float, List[dict]]:
+    """
+    Get one driving route through an ordered list of stops (addresses or "City, State").
+    Geocodes all stops concurrently, then makes a single ORS Directions call.
+    Returns (polyline as (n, 2) array of (lat, lon), total_km, legs), where each leg is
+    { from, to, distance_km, start_km, end_km, polyline_start, polyline_end }.
+    """
+    from routes.services.geocode import geocode_waypoints
+
+    if len(waypoints) < 2:
+        raise ValueError("At least an origin and a destination are required")
+    data = request_ors_directions(geocode_waypoints(waypoints))
+    polyline_points, total_km = parse_ors_route_response(data)
+
+    parsed = parse_ors_route_legs(data, len(polyline_points))
+    names = list(zip(waypoints, waypoints[1:]))
+    if len(parsed) != len(names):
+        names = [(waypoints[0], waypoints[-1])]
+
+    legs = []
+    start_km = 0.0
+    for (distance_km, start, end), (name_from, name_to) in zip(parsed, names):
+        legs.append({
+            "from": name_from,
+            "to": name_to,
+            "distance_km": distance_km,
+            "start_km": start_km,
+            "end_km": start_km + distance_km,
+            "polyline_start": start,
+            "polyline_end": end,
+        })
+        start_km += distance_km
+    return polyline_points, total_km, legs
+
 
 def get_route(
     origin: str,
     destination: str,
-) -> Tuple[List[Tuple[float, float]], float]:
+) -> Tuple[np.ndarray, float]:
     """
     Get driving route from origin to destination (addresses or "City, State").
-    Geocodes both, then calls ORS. Returns (polyline as (lat, lon), total_km).
+    Geocodes both, then calls ORS. Returns (polyline as (n, 2) array of (lat, lon), total_km).
     """
-    from routes.services.geocode import geocode_origin_destination
-
-    (lat_orig, lon_orig), (lat_dest, lon_dest) = geocode_origin_destination(origin, destination)
-    return get_route_ors(lat_orig, lon_orig, lat_dest, lon_dest)
+    polyline_points, total_km, _ = get_route_via([origin, destination])
+    return polyline_points, total_km
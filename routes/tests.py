@@ -1,3 +1,478 @@
-from django.test import TestCase
+import random
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import polyline
+from django.http import QueryDict
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from routes.fake_ors import synthetic_directions
+from routes.models import FuelStation, PlanJob
+from routes.services import fuel, jobs
+from routes.services.fuel import (
+    KM_PER_DEG,
+    FuelStationKDTree,
+    ShardedFuelStationIndex,
+    haversine_km_array,
+    query_corridor_database,
+)
+from routes.services.optimizer import (
+    VEHICLE_RANGE_KM,
+    StationPosition,
+    prune_dominated,
+    select_fuel_stops,
+)
+from routes.services.replan import ReplanContext, replan_fuel_stops
+from routes.services.routing import _decode_polyline, get_route_via, parse_ors_route_legs, parse_ors_route_response
+from routes.views import MAX_STOP_LENGTH, MAX_WAYPOINTS, _waypoints_from
+
+
+def _position(station_id: int, km: float, price: float, detour_km: float = 1.0) -> StationPosition:
+    station = FuelStation(id=station_id, truck_stop_name=f"Station {station_id}", retail_price=Decimal(str(price)))
+    return StationPosition(station, km, detour_km)
+
+
+def _stop_ids(positions, total_km: float, max_stops: int = 10):
+    stops = select_fuel_stops(positions, total_km=total_km, range_km=VEHICLE_RANGE_KM, max_stops=max_stops)
+    return [s.id for s in stops]
+
+
+class PruneDominatedTests(SimpleTestCase):
+    def assertPruningKeepsStops(self, positions, total_km: float, max_stops: int = 10):
+        pruned = prune_dominated(positions, total_km=total_km, range_km=VEHICLE_RANGE_KM, max_stops=max_stops)
+        self.assertEqual(
+            _stop_ids(pruned, total_km, max_stops),
+            _stop_ids(sorted(positions, key=lambda p: p.km), total_km, max_stops),
+        )
+        return pruned
+
+    def test_slowly_falling_prices_keep_a_stop_per_segment(self):
+        positions = [_position(i, 4.0 * i, 4.0 - 0.001 * i) for i in range(400)]
+        total_km = 2 * VEHICLE_RANGE_KM
+        pruned = self.assertPruningKeepsStops(positions, total_km)
+        self.assertEqual(len(_stop_ids(pruned, total_km)), 2)
+
+    def test_station_is_not_pruned_by_one_in_the_next_segment(self):
+        positions = [
+            _position(1, 100.0, 3.50),
+            _position(2, 802.0, 3.00),
+            _position(3, 806.0, 2.90),
+            _position(4, 1500.0, 2.80),
+        ]
+        self.assertPruningKeepsStops(positions, 2 * VEHICLE_RANGE_KM)
+        self.assertEqual(_stop_ids(prune_dominated(positions, total_km=2 * VEHICLE_RANGE_KM), 2 * VEHICLE_RANGE_KM), [2, 4])
+
+    def test_dominated_station_is_pruned(self):
+        positions = [_position(1, 10.0, 3.10, detour_km=2.0), _position(2, 12.0, 3.00, detour_km=1.0)]
+        pruned = self.assertPruningKeepsStops(positions, 500.0)
+        self.assertEqual([p.station.id for p in pruned], [2])
+
+    def test_random_routes_keep_the_same_stops(self):
+        rng = random.Random(0)
+        for _ in range(40):
+            total_km = rng.uniform(200, 5000)
+            positions = [
+                _position(
+                    i,
+                    round(rng.uniform(0, total_km), 1),
+                    round(rng.uniform(3.0, 4.5), 2),
+                    round(rng.uniform(0, 30), 1),
+                )
+                for i in range(rng.randint(1, 600))
+            ]
+            self.assertPruningKeepsStops(positions, total_km, max_stops=rng.choice([3, 10]))
+
+
+class CheapestNearTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 3000
+        self.coords = np.column_stack([rng.uniform(25, 49, n), rng.uniform(-124, -67, n)])
+        self.prices = np.round(rng.uniform(3.0, 4.5, n), 3)
+        self.index = FuelStationKDTree()
+        self.index.set_columns(
+            list(range(1, n + 1)), self.coords.tolist(), self.prices.tolist(), [f"Station {i}" for i in range(n)]
+        )
+        self.points = np.column_stack([rng.uniform(26, 48, 100), rng.uniform(-122, -70, 100)])
+
+    def test_matches_brute_force_at_every_radius(self):
+        k, detour_cost = 5, 0.01
+        for radius_km in (50, 150, 300, 500):
+            top, dist, score = self.index.cheapest_near(self.points, radius_km, k=k, detour_cost_per_km=detour_cost)
+            all_dist = haversine_km_array(
+                self.points[:, [0]], self.points[:, [1]], self.coords[:, 0], self.coords[:, 1]
+            )
+            all_score = np.where(all_dist <= radius_km, self.prices + detour_cost * all_dist, np.inf)
+            expected = np.sort(all_score, axis=1)[:, :k]
+            np.testing.assert_allclose(score, expected, err_msg=f"radius_km={radius_km}")
+            self.assertTrue(np.all((top >= 0) == np.isfinite(expected)))
+            self.assertTrue(np.all(dist[top >= 0] <= radius_km))
+
+
+class ShardedIndexTests(TestCase):
+    STATES = ["AA", "BB", "CC", "DD", "EE", "FF"]
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        stations = []
+        for s, state in enumerate(cls.STATES):
+            lat0, lon0 = 30.0 + 3 * s, -110.0 + 7 * s
+            for i in range(200):
+                stations.append(FuelStation(
+                    opis_truck_stop_id=len(stations),
+                    truck_stop_name=f"{state} {i}",
+                    address="",
+                    city="",
+                    state=state,
+                    rack_id=0,
+                    retail_price=Decimal(str(round(rng.uniform(3.0, 4.5), 3))),
+                    latitude=lat0 + rng.uniform(-1, 1),
+                    longitude=lon0 + rng.uniform(-1.5, 1.5),
+                ))
+        FuelStation.objects.bulk_create(stations)
+
+    def setUp(self):
+        self.monolithic = FuelStationKDTree()
+        self.monolithic.build()
+        # roughly two shards' worth
+        self.sharded = ShardedFuelStationIndex(2 * self.monolithic.memory_bytes() // len(self.STATES))
+        self.sharded.build()
+        self.points = [(30.0 + 0.6 * i, -110.0 + 1.4 * i) for i in range(26)]
+
+    def test_matches_monolithic_index(self):
+        self.assertEqual(
+            sorted(self.sharded.query_corridor(self.points, 0.3)),
+            sorted(self.monolithic.query_corridor(self.points, 0.3)),
+        )
+        expected = self.monolithic.cheapest_near_stations(self.points, 100, k=3, detour_cost_per_km=0.01)
+        found = self.sharded.cheapest_near_stations(self.points, 100, k=3, detour_cost_per_km=0.01)
+        self.assertEqual([[s["score"] for s in row] for row in found], [[s["score"] for s in row] for row in expected])
+
+    def test_database_backend_matches_kdtree_corridor(self):
+        for radius_deg in (0.1, 0.3, 1.0):
+            expected = sorted(self.monolithic.query_corridor(self.points, radius_deg))
+            self.assertTrue(expected)
+            # several chunks, so several bounding boxes ORed in one query
+            for chunk_points in (4, 256):
+                found = query_corridor_database(self.points, radius_deg, chunk_points=chunk_points)
+                self.assertEqual(sorted(s.id for s in found), expected)
+
+    def test_budget_is_enforced_after_a_query_touching_every_shard(self):
+        self.sharded.cheapest_near_stations(self.points, 100)
+        status = self.sharded.shard_status()
+        self.assertEqual(status["loads"], len(self.STATES))
+        self.assertLess(len(status["resident"]), len(self.STATES))
+        self.assertLessEqual(status["memory_bytes"], status["memory_budget_bytes"])
+
+        # a later query on resident shards only keeps the index within budget
+        self.sharded.query_corridor(self.points[-3:], 0.3)
+        self.assertLessEqual(self.sharded.shard_status()["memory_bytes"], self.sharded.memory_budget_bytes)
+
+
+class ReplanTests(SimpleTestCase):
+    """Straight 1822 km route along the equator: stations every 50 km from km 20, a cheap one at km 520."""
+
+    TOTAL_KM = 1822.0
+
+    def setUp(self):
+        lon = np.linspace(0.0, self.TOTAL_KM / KM_PER_DEG, 1000)
+        polyline = np.column_stack([np.zeros_like(lon), lon])
+        self.positions = [
+            _position(i, km, 3.0 if km == 520 else 3.5, detour_km=0.0)
+            for i, km in enumerate(range(20, int(self.TOTAL_KM), 50))
+        ]
+        self.context = ReplanContext(1, polyline, self.TOTAL_KM, [(p.station, p.km) for p in self.positions])
+
+    def _replan_km(self, fuel_km: float, km: float = 0.0):
+        result = replan_fuel_stops(self.context, 0.0, km / KM_PER_DEG, fuel_km=fuel_km)
+        return [round(float(self.context.station_km[i])) for i in result["stop_indices"]], result["reachable"]
+
+    def test_full_tank_at_origin_reproduces_the_plan(self):
+        planned = [s.id for s in select_fuel_stops(self.positions, total_km=self.TOTAL_KM)]
+        result = replan_fuel_stops(self.context, 0.0, 0.0, fuel_km=VEHICLE_RANGE_KM)
+        self.assertEqual([self.context.stations[i].id for i in result["stop_indices"]], planned)
+        self.assertIn(520, self._replan_km(VEHICLE_RANGE_KM)[0])
+
+    def test_low_fuel_stops_within_reach_first(self):
+        for fuel_km, first_km in ((100, 20), (30, 20)):
+            stops, reachable = self._replan_km(fuel_km)
+            self.assertEqual(stops[0], first_km, f"fuel_km={fuel_km}")
+            self.assertTrue(reachable, f"fuel_km={fuel_km}")
+
+    def test_fuel_covering_the_rest_needs_no_stops(self):
+        self.assertEqual(self._replan_km(VEHICLE_RANGE_KM, km=1300.0), ([], True))
+
+    def test_no_station_within_reach_is_unreachable(self):
+        self.assertFalse(self._replan_km(10.0)[1])
+
+
+class JsonPostTests(TestCase):
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+
+    def test_plan_and_replan_accept_json_posts_without_csrf_token(self):
+        response = self.client.post("/api/plan-route/", {"waypoints": ["Chicago, IL"]}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/api/replan-route/",
+            {"plan_id": 999, "lat": 41.9, "lon": -87.6, "fuel_level": 0.5},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_nearby_stations_rejects_non_finite_costs_and_fractional_k(self):
+        points = [[41.9, -87.6]]
+        for bad in (
+            {"detour_cost_per_km": float("nan")},
+            {"detour_cost_per_km": "inf"},
+            {"radius_km": float("nan")},
+            {"k": 2.9},
+            {"k": "nan"},
+        ):
+            response = self.client.post(
+                "/api/nearby-stations/", {"points": points, **bad}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400, bad)
+
+
+class CorridorTests(SimpleTestCase):
+    def test_tiled_corridor_matches_per_point_queries(self):
+        rng = np.random.default_rng(1)
+        coords = np.column_stack([rng.uniform(25, 49, 4000), rng.uniform(-124, -67, 4000)])
+        index = FuelStationKDTree()
+        index.set_columns(list(range(4000)), coords.tolist(), [3.5] * 4000, [""] * 4000)
+        for _ in range(10):
+            start, end = rng.uniform([26, -122], [48, -70], size=(2, 2))
+            points = start + np.linspace(0, 1, 200)[:, None] * (end - start) + rng.normal(0, 0.05, (200, 2))
+            for radius_deg in (0.1, 0.3):
+                expected = set()
+                for point in points:
+                    expected.update(index._tree.query_ball_point(point, r=radius_deg))
+                self.assertEqual(sorted(index.query_corridor(points, radius_deg)), sorted(expected))
+
+        # the same lane again is answered from cached tiles
+        misses = index.tile_misses
+        index.query_corridor(points, 0.3)
+        self.assertEqual(index.tile_misses, misses)
+        self.assertGreater(index.tile_stats()["hits"], 0)
+
+
+class DecodePolylineTests(SimpleTestCase):
+    def assertDecodesLike(self, encoded: str, precision: int = 5):
+        expected = np.asarray(polyline.decode(encoded, precision), dtype=float).reshape(-1, 2)
+        np.testing.assert_array_equal(_decode_polyline(encoded, precision), expected)
+
+    def test_random_routes(self):
+        rng = random.Random(0)
+        for _ in range(50):
+            lat, lon = rng.uniform(25, 49), rng.uniform(-124, -67)
+            coords = []
+            for _ in range(rng.randint(2, 2000)):
+                lat += rng.uniform(-0.01, 0.01)
+                lon += rng.uniform(-0.01, 0.01)
+                coords.append((lat, lon))
+            self.assertDecodesLike(polyline.encode(coords))
+
+    def test_large_jumps_and_precision_6(self):
+        coords = [(-89.99999, 179.99999), (89.99999, -179.99999), (0.0, 0.0), (-45.5, 120.25), (45.5, -120.25)]
+        self.assertDecodesLike(polyline.encode(coords))
+        self.assertDecodesLike(polyline.encode(coords, 6), precision=6)
+
+    def test_single_point_and_empty(self):
+        self.assertDecodesLike(polyline.encode([(41.8781, -87.6298)]))
+        self.assertEqual(_decode_polyline("").shape, (0, 2))
+
+    def test_malformed_input(self):
+        for encoded in ("_", "_p~iF", "_p~iF~ps|U_", "caf\u00e9"):
+            with self.assertRaises(ValueError, msg=encoded):
+                _decode_polyline(encoded)
+        with self.assertRaises(RuntimeError):
+            parse_ors_route_response({"routes": [{"geometry": "_", "summary": {"distance": 1000}}]})
+
+
+def _station(state: str, lat: float, lon: float, price: float = 3.5) -> FuelStation:
+    return FuelStation(
+        opis_truck_stop_id=0,
+        truck_stop_name=f"{state} station",
+        address="",
+        city="",
+        state=state,
+        rack_id=0,
+        retail_price=Decimal(str(price)),
+        latitude=lat,
+        longitude=lon,
+    )
+
+
+class IndexLifecycleTests(TestCase):
+    def setUp(self):
+        saved = (fuel._fuel_station_index, fuel._index_state, fuel._index_error)
+        self.addCleanup(self._restore, saved)
+        fuel._fuel_station_index, fuel._index_state, fuel._index_error = None, "cold", None
+
+    @staticmethod
+    def _restore(saved):
+        fuel._fuel_station_index, fuel._index_state, fuel._index_error = saved
+
+    def test_empty_station_table_is_not_ready_and_is_rebuilt(self):
+        index = fuel.ensure_fuel_station_index_built()
+        self.assertFalse(index.is_ready())
+        self.assertEqual(fuel.fuel_index_status()["state"], "empty")
+
+        _station("TX", 32.7, -96.8).save()
+        index = fuel.ensure_fuel_station_index_built()
+        self.assertEqual(index.station_count, 1)
+        self.assertEqual(fuel.fuel_index_status()["state"], "ready")
+
+    @override_settings(FUEL_INDEX_COLD_POLICY="reject")
+    def test_reject_policy_never_builds_inline(self):
+        for state in ("cold", "failed", "empty", "building"):
+            fuel._index_state = state
+            with mock.patch.object(fuel, "_start_build_thread") as start, \
+                    mock.patch.object(fuel, "_build_index") as build:
+                with self.assertRaises(fuel.IndexNotReady):
+                    fuel.ensure_fuel_station_index_built()
+            start.assert_called_once_with()
+            build.assert_not_called()
+
+        # callers that must have the index (e.g. run_plan_workers) can still wait for it
+        fuel._index_state = "cold"
+        self.assertFalse(fuel.ensure_fuel_station_index_built(cold_policy="wait").is_ready())
+
+
+class PlanJobQueueTests(TestCase):
+    def setUp(self):
+        self.first, self.second = jobs.submit_jobs([["Chicago, IL", "Denver, CO"], ["A", "B", "C"]])
+
+    def test_claimed_job_is_not_claimed_again_until_requeued(self):
+        self.assertEqual(jobs.claim_next_job("w1").id, self.first.id)
+        self.assertEqual(jobs.claim_next_job("w2").id, self.second.id)
+        self.assertIsNone(jobs.claim_next_job("w3"))
+
+        # only jobs running for longer than the cutoff go back to the queue
+        self.assertEqual(jobs.requeue_stale_jobs(600), 0)
+        PlanJob.objects.filter(id=self.first.id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale_jobs(600), 1)
+        job = PlanJob.objects.get(id=self.first.id)
+        self.assertEqual((job.status, job.worker, job.started_at), (PlanJob.QUEUED, "", None))
+        self.assertEqual(jobs.claim_next_job("w4").id, self.first.id)
+
+    def test_run_job_stores_result_or_error(self):
+        with mock.patch.object(jobs, "build_plan", return_value={"total_cost": 1.0}) as build:
+            job = jobs.run_job(jobs.claim_next_job("w1"))
+        build.assert_called_once_with(["Chicago, IL", "Denver, CO"], remember=False)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.error), (PlanJob.DONE, {"total_cost": 1.0}, ""))
+        self.assertIsNotNone(job.finished_at)
+
+        with mock.patch.object(jobs, "build_plan", side_effect=ValueError("no route")):
+            job = jobs.run_job(jobs.claim_next_job("w1"))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.error), (PlanJob.FAILED, None, "no route"))
+        self.assertEqual(jobs.job_payload(job)["error"], "no route")
+
+    def test_queue_stats_counts_jobs_by_status(self):
+        stats = jobs.queue_stats()
+        self.assertEqual(stats["depth"], 2)
+        self.assertEqual(stats["counts"], {"queued": 2, "running": 0, "done": 0, "failed": 0})
+        self.assertEqual(stats["timings_window"], 0)
+
+        with mock.patch.object(jobs, "build_plan", return_value={}):
+            jobs.run_job(jobs.claim_next_job("w1"))
+        jobs.claim_next_job("w2")
+        stats = jobs.queue_stats()
+        self.assertEqual(stats["depth"], 0)
+        self.assertEqual(stats["counts"], {"queued": 0, "running": 1, "done": 1, "failed": 0})
+        self.assertEqual(stats["timings_window"], 1)
+        self.assertIsNotNone(stats["run_seconds"]["p50"])
+
+
+class RouteLegsTests(SimpleTestCase):
+    STOPS = {
+        "Chicago, IL": (41.8781, -87.6298),
+        "Denver, CO": (39.7392, -104.9903),
+        "Phoenix, AZ": (33.4484, -112.0740),
+    }
+
+    def setUp(self):
+        self.data = synthetic_directions([[lon, lat] for lat, lon in self.STOPS.values()])
+
+    def test_legs_follow_way_points_and_segments(self):
+        points, total_km = parse_ors_route_response(self.data)
+        legs = parse_ors_route_legs(self.data, len(points))
+        route = self.data["routes"][0]
+        self.assertEqual(len(legs), 2)
+        self.assertEqual([start for _, start, _ in legs] + [legs[-1][2]], route["way_points"])
+        self.assertEqual((legs[0][1], legs[-1][2]), (0, len(points) - 1))
+        self.assertEqual(legs[0][2], legs[1][1])
+        self.assertEqual([km for km, _, _ in legs], [s["distance"] / 1000.0 for s in route["segments"]])
+        self.assertAlmostEqual(sum(km for km, _, _ in legs), total_km)
+        # each way point is the stop itself (up to polyline precision)
+        np.testing.assert_allclose(points[route["way_points"]], list(self.STOPS.values()), atol=1e-5)
+
+    def test_single_leg_without_matching_way_points(self):
+        points, total_km = parse_ors_route_response(self.data)
+        for way_points in (None, [0, len(points) - 1]):
+            data = synthetic_directions([[lon, lat] for lat, lon in self.STOPS.values()])
+            data["routes"][0]["way_points"] = way_points
+            self.assertEqual(parse_ors_route_legs(data, len(points)), [(total_km, 0, len(points) - 1)])
+
+    def _route_via(self, data):
+        with mock.patch("routes.services.geocode.geocode_waypoints", return_value=list(self.STOPS.values())), \
+                mock.patch("routes.services.routing.request_ors_directions", return_value=data):
+            return get_route_via(list(self.STOPS))
+
+    def test_get_route_via_names_legs(self):
+        _, total_km, legs = self._route_via(self.data)
+        self.assertEqual(
+            [(leg["from"], leg["to"]) for leg in legs],
+            [("Chicago, IL", "Denver, CO"), ("Denver, CO", "Phoenix, AZ")],
+        )
+        self.assertEqual(legs[0]["end_km"], legs[1]["start_km"])
+        self.assertAlmostEqual(legs[-1]["end_km"], total_km)
+
+        del self.data["routes"][0]["way_points"]
+        _, total_km, legs = self._route_via(self.data)
+        self.assertEqual(
+            [(leg["from"], leg["to"], leg["distance_km"]) for leg in legs],
+            [("Chicago, IL", "Phoenix, AZ", total_km)],
+        )
+
+
+class WaypointParamsTests(SimpleTestCase):
+    def test_stops_from_waypoints_or_origin_via_destination(self):
+        cases = [
+            ({"origin": " A ", "destination": "D"}, ["A", "D"]),
+            ({"origin": "A", "via": ["B", "C"], "destination": "D"}, ["A", "B", "C", "D"]),
+            ({"origin": "A", "via": "B", "destination": "D"}, ["A", "B", "D"]),
+            # waypoints win over origin/destination
+            ({"waypoints": ["X", "Y", "Z"], "origin": "A", "destination": "D"}, ["X", "Y", "Z"]),
+            (QueryDict("origin=A&via=B&via=C&destination=D"), ["A", "B", "C", "D"]),
+            (QueryDict("waypoints=X&waypoints=Y"), ["X", "Y"]),
+        ]
+        for params, expected in cases:
+            self.assertEqual(_waypoints_from(params), (expected, None))
+
+    def test_invalid_stops(self):
+        for params in (
+            {"origin": "A"},
+            {"waypoints": ["A"]},
+            {"waypoints": ["A", " "]},
+            {"waypoints": ["A", 7]},
+            {"waypoints": [str(i) for i in range(MAX_WAYPOINTS + 1)]},
+            {"origin": "A", "destination": "D" * (MAX_STOP_LENGTH + 1)},
+            QueryDict("origin=A&via=&destination=D"),
+        ):
+            stops, error = _waypoints_from(params)
+            self.assertIsNone(stops, params)
+            self.assertTrue(error)
+        self.assertIsNone(_waypoints_from({"origin": "A", "destination": "D" * MAX_STOP_LENGTH})[1])
+
+    def test_over_long_stop_is_a_400(self):
+        response = Client().get("/api/plan-route/", {"origin": "Chicago, IL", "destination": "x" * 256})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(MAX_STOP_LENGTH), response.json()["error"])
@@ -4,4 +4,10 @@ from . import views
 
 urlpatterns = [
     path("plan-route/", views.plan_route),
-]
\ No newline at end of file
+    path("replan-route/", views.replan_route),
+    path("nearby-stations/", views.nearby_stations),
+    path("plan-jobs/", views.submit_plan_jobs),
+    path("plan-jobs/stats/", views.plan_job_stats),
+    path("plan-jobs/<int:job_id>/", views.plan_job_status),
+    path("ready/", views.ready),
+]
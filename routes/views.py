@@ -1,53 +1,275 @@
+import json
 import math
 
 from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 
-from routes.services.routing import get_route
-from routes.services.optimizer import get_optimal_fuel_stops, VEHICLE_RANGE_KM
+from routes.models import PlanJob, RoutePlan
+from routes.services.fuel import (
+    IndexNotReady,
+    fuel_index_status,
+    get_cheapest_stations_near_points,
+    start_index_warmup,
+)
+from routes.services.jobs import job_payload, queue_stats, submit_jobs
+from routes.services.optimizer import VEHICLE_RANGE_KM
+from routes.services.planner import RoutingError, build_plan
+from routes.services.replan import get_replan_context, replan_fuel_stops
 
 
-def plan_route(request):
-    """
-    GET or POST: ?origin=...&destination=... (or JSON body).
-    Returns JSON: { "polyline": [[lat,lon],...], "total_km": float, "fuel_stops": [{ id, name, price, lat, lon }, ...] }.
-    """
+MAX_JOBS_PER_SUBMIT = 1000
+MAX_WAYPOINTS = 25
+# origin/destination are stored in CharField(max_length=255) columns
+MAX_STOP_LENGTH = 255
+MAX_NEARBY_POINTS = 5000
+MAX_NEARBY_K = 20
+DEFAULT_DETOUR_COST_PER_KM = 0.01
+
+
+def _request_params(request):
+    """JSON body for POST application/json, query params otherwise. None if the body is not valid JSON."""
     if request.method == "POST" and request.content_type == "application/json":
-        import json
         try:
             body = json.loads(request.body)
         except json.JSONDecodeError:
-            return JsonResponse({"error": "Invalid JSON"}, status=400)
-        origin = body.get("origin") or body.get("origin_address")
-        destination = body.get("destination") or body.get("destination_address")
+            return None
+        return body if isinstance(body, dict) else None
+    return request.GET
+
+
+def _list_param(params, key):
+    """List value for `key`: a JSON list, or repeated query params (?key=a&key=b)."""
+    if hasattr(params, "getlist"):
+        return params.getlist(key)
+    value = params.get(key)
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _waypoints_from(params):
+    """
+    Stops of a trip in order, from `waypoints` or from origin/destination plus optional `via`.
+    Returns (stops, None) or (None, error message).
+    """
+    if params.get("waypoints"):
+        stops = _list_param(params, "waypoints")
     else:
-        origin = request.GET.get("origin") or request.GET.get("origin_address")
-        destination = request.GET.get("destination") or request.GET.get("destination_address")
+        origin = params.get("origin") or params.get("origin_address")
+        destination = params.get("destination") or params.get("destination_address")
+        if not origin or not destination:
+            return None, "origin and destination (or waypoints) required"
+        stops = [origin, *_list_param(params, "via"), destination]
+
+    if not all(isinstance(stop, str) and stop.strip() for stop in stops):
+        return None, "waypoints must be non-empty strings"
+    if not 2 <= len(stops) <= MAX_WAYPOINTS:
+        return None, f"a trip needs 2 to {MAX_WAYPOINTS} waypoints"
+    stops = [stop.strip() for stop in stops]
+    if any(len(stop) > MAX_STOP_LENGTH for stop in stops):
+        return None, f"waypoints must be at most {MAX_STOP_LENGTH} characters"
+    return stops, None
+
+
+def _not_ready(error: IndexNotReady) -> JsonResponse:
+    response = JsonResponse({"error": str(error)}, status=503)
+    response["Retry-After"] = "5"
+    return response
 
-    if not origin or not destination:
-        return JsonResponse({"error": "origin and destination required"}, status=400)
+
+@csrf_exempt
+def plan_route(request):
+    """
+    GET or POST: ?origin=...&destination=...[&via=...&via=...] or ?waypoints=...&waypoints=... (or JSON body).
+    Returns JSON: { "plan_id": int, "waypoints": [str, ...], "polyline": [[lat,lon],...], "total_km": float,
+    "legs": [{ from, to, distance_km, start_km, end_km, polyline_start, polyline_end }, ...],
+    "fuel_stops": [{ id, name, price, lat, lon }, ...], "debug": { "candidates": int, "pruned_candidates": int } }.
+    """
+    params = _request_params(request)
+    if params is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    waypoints, error = _waypoints_from(params)
+    if error:
+        return JsonResponse({"error": error}, status=400)
 
     try:
-        polyline, total_km = get_route(origin, destination)
+        body = build_plan(waypoints)
     except ValueError as e:
         return JsonResponse({"error": str(e)}, status=400)
-    except Exception as e:
-        return JsonResponse({"error": f"Routing failed: {e}"}, status=502)
+    except RoutingError as e:
+        return JsonResponse({"error": str(e)}, status=502)
+    except IndexNotReady as e:
+        return _not_ready(e)
+
+    return JsonResponse(body)
+
+
+@csrf_exempt
+def replan_route(request):
+    """
+    GET or POST: ?plan_id=...&lat=...&lon=...&fuel_level=... (or JSON body).
+    fuel_level is the tank fraction 0..1; fuel_km (km of range left) may be sent instead.
+    Returns JSON: { "plan_id", "position_km", "offset_km", "remaining_km", "reachable",
+    "fuel_stops": [{ id, name, price, lat, lon, km }, ...] } for the rest of the stored route.
+    """
+    params = _request_params(request)
+    if params is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    try:
+        plan_id = int(params.get("plan_id"))
+        lat = float(params.get("lat"))
+        lon = float(params.get("lon"))
+        if params.get("fuel_km") is not None:
+            fuel_km = float(params.get("fuel_km"))
+        else:
+            fuel_km = float(params.get("fuel_level")) * VEHICLE_RANGE_KM
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "plan_id, lat, lon and fuel_level (or fuel_km) required"}, status=400)
+    if not all(math.isfinite(v) for v in (lat, lon, fuel_km)):
+        return JsonResponse({"error": "lat, lon and fuel must be finite numbers"}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or fuel_km < 0:
+        return JsonResponse({"error": "lat/lon out of range or negative fuel"}, status=400)
+
+    try:
+        context = get_replan_context(plan_id)
+    except RoutePlan.DoesNotExist:
+        return JsonResponse({"error": f"Unknown plan_id: {plan_id}"}, status=404)
 
-    max_stops = max(1, math.ceil(total_km / VEHICLE_RANGE_KM))
-    stops = get_optimal_fuel_stops(polyline, total_km=total_km, range_km=VEHICLE_RANGE_KM, max_stops=max_stops)
+    result = replan_fuel_stops(context, lat, lon, fuel_km=min(fuel_km, VEHICLE_RANGE_KM))
     fuel_stops = [
         {
-            "id": s.id,
-            "name": s.truck_stop_name,
-            "price": float(s.retail_price),
-            "lat": s.latitude,
-            "lon": s.longitude,
+            "id": context.stations[i].id,
+            "name": context.stations[i].truck_stop_name,
+            "price": float(context.stations[i].retail_price),
+            "lat": context.stations[i].latitude,
+            "lon": context.stations[i].longitude,
+            "km": float(context.station_km[i]),
         }
-        for s in stops
+        for i in result["stop_indices"]
     ]
 
     return JsonResponse({
-        "polyline": list(polyline),
-        "total_km": total_km,
+        "plan_id": plan_id,
+        "position_km": result["position_km"],
+        "offset_km": result["offset_km"],
+        "remaining_km": result["remaining_km"],
+        "reachable": result["reachable"],
         "fuel_stops": fuel_stops,
-    })
\ No newline at end of file
+    })
+
+
+@csrf_exempt
+def nearby_stations(request):
+    """
+    POST JSON: { "points": [[lat, lon], ...], "radius_km": 25, "k": 5, "rank": "price" | "price_detour",
+    "detour_cost_per_km": 0.01 }. For "price_detour" the score is price + detour_cost_per_km * distance_km.
+    Returns JSON: { "results": [{ "point": [lat, lon], "stations": [{ id, name, price, lat, lon, distance_km, score }, ...] }, ...] }
+    in input order, cheapest (lowest score) first.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST a JSON body with points"}, status=405)
+    params = _request_params(request)
+    if params is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    points = params.get("points")
+    try:
+        points = [(float(lat), float(lon)) for lat, lon in points]
+        radius_km = float(params.get("radius_km", 25))
+        k = float(params.get("k", 5))
+        detour_cost_per_km = float(params.get("detour_cost_per_km", DEFAULT_DETOUR_COST_PER_KM))
+    except (TypeError, ValueError):
+        return JsonResponse({"error": "points must be [[lat, lon], ...]; radius_km, k numeric"}, status=400)
+    rank = params.get("rank", "price")
+    if rank not in ("price", "price_detour"):
+        return JsonResponse({"error": "rank must be 'price' or 'price_detour'"}, status=400)
+    if not points or len(points) > MAX_NEARBY_POINTS:
+        return JsonResponse({"error": f"Send between 1 and {MAX_NEARBY_POINTS} points"}, status=400)
+    if not all(-90 <= lat <= 90 and -180 <= lon <= 180 for lat, lon in points):
+        return JsonResponse({"error": "lat/lon out of range"}, status=400)
+    if not 0 < radius_km <= 500 or not k.is_integer() or not 1 <= k <= MAX_NEARBY_K:
+        return JsonResponse(
+            {"error": f"radius_km must be in (0, 500], k an integer in [1, {MAX_NEARBY_K}]"}, status=400
+        )
+    if not math.isfinite(detour_cost_per_km) or detour_cost_per_km < 0:
+        return JsonResponse({"error": "detour_cost_per_km must be a finite number >= 0"}, status=400)
+    k = int(k)
+
+    try:
+        results = get_cheapest_stations_near_points(
+            points,
+            radius_km=radius_km,
+            k=k,
+            detour_cost_per_km=detour_cost_per_km if rank == "price_detour" else 0.0,
+        )
+    except IndexNotReady as e:
+        return _not_ready(e)
+
+    return JsonResponse({
+        "results": [
+            {"point": [lat, lon], "stations": stations}
+            for (lat, lon), stations in zip(points, results)
+        ],
+    })
+
+
+@csrf_exempt
+def submit_plan_jobs(request):
+    """
+    POST JSON: one trip { "origin", "destination", "via"? } or { "waypoints": [...] }, or { "jobs": [trip, ...] }.
+    Queues plans for `manage.py run_plan_workers`. Returns 202 JSON: { "job_ids": [int, ...], "status": "queued" }.
+    """
+    if request.method != "POST":
+        return JsonResponse({"error": "POST origin/destination or a jobs list"}, status=405)
+    params = _request_params(request)
+    if params is None:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    items = params.get("jobs") if "jobs" in params else [params]
+    if not isinstance(items, list) or not 1 <= len(items) <= MAX_JOBS_PER_SUBMIT:
+        return JsonResponse({"error": f"jobs must be a list of 1 to {MAX_JOBS_PER_SUBMIT} trips"}, status=400)
+    trips = []
+    for item in items:
+        if not isinstance(item, dict):
+            return JsonResponse({"error": "each job needs origin and destination (or waypoints)"}, status=400)
+        waypoints, error = _waypoints_from(item)
+        if error:
+            return JsonResponse({"error": error}, status=400)
+        trips.append(waypoints)
+
+    jobs = submit_jobs(trips)
+    return JsonResponse({"job_ids": [job.id for job in jobs], "status": PlanJob.QUEUED}, status=202)
+
+
+def plan_job_status(request, job_id):
+    """
+    GET: job status with queue/run timings; includes "result" (the plan_route body) when done
+    or "error" when failed.
+    """
+    try:
+        job = PlanJob.objects.get(id=job_id)
+    except PlanJob.DoesNotExist:
+        return JsonResponse({"error": f"Unknown job_id: {job_id}"}, status=404)
+    return JsonResponse(job_payload(job))
+
+
+def plan_job_stats(request):
+    """GET: queue depth, per-status counts, queue/run time percentiles and jobs/s throughput."""
+    return JsonResponse(queue_stats())
+
+
+def ready(request):
+    """
+    Readiness probe: 200 once this process's fuel station index is built (always, with the
+    database corridor backend), 503 before that or while the station table is empty. A cold index
+    (warmup off), a failed build or an empty one is (re)started in the background, so a
+    probe-gated worker is not kept out of rotation for good.
+    Returns JSON: { "state", "station_count", "build_seconds", "data_version", "error", "corridor_backend",
+    "index_mode", "memory_bytes", "tile_cache", "shards" (resident shards and memory budget in sharded mode, else null) }.
+    """
+    status = fuel_index_status()
+    if status["state"] in ("cold", "failed", "empty") and start_index_warmup():
+        status = fuel_index_status()
+    ok = status["state"] == "ready" or status["corridor_backend"] == "database"
+    return JsonResponse(status, status=200 if ok else 503)